@@ -0,0 +1,267 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps
+from langchain_core.load import loads
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded LRU cache with an optional per-entry TTL.
+    """
+    def __init__(
+        self,
+        maxsize=256,
+        ttl=None,
+        ):
+        """
+        Args:
+            maxsize (int): The maximum number of entries kept in the cache.
+            ttl (float, optional): Seconds after which an entry expires.
+                                   None disables expiry. Defaults to None.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for `key`, or `default` when missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores `value` under `key`, evicting the least recently used entry when full."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for `key`, computing and storing it on a miss."""
+        _missing = object()
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        """Returns the current size and hit/miss/eviction counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key onto one in-flight task,
+    so duplicate work runs once and every caller receives the same result.
+
+    Must be used from a single event loop; no result is kept once the task finishes.
+    """
+    def __init__(
+        self,
+        on_coalesced=None,
+        ):
+        """
+        Args:
+            on_coalesced (callable, optional): Called with no arguments each time a call
+                                               attaches to an already running task.
+        """
+        self.on_coalesced = on_coalesced
+        self._inflight = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        """
+        Awaits the in-flight task for `key`, starting `factory()` if there is none.
+        A caller being cancelled does not cancel the shared task for the others.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            if self.on_coalesced is not None:
+                self.on_coalesced()
+        else:
+            self.executions += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 모든 호출자가 취소된 경우에도 예외가 "never retrieved"로 남지 않도록 확인
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        """Returns executions, coalesced calls and the number of tasks in flight."""
+        calls = self.executions + self.coalesced
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": round(self.coalesced / calls, 4) if calls else 0.0,
+        }
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    A persistent LangChain LLM cache backed by a local SQLite file, with size
+    and age eviction and hit-rate statistics.
+
+    Entries are keyed on the prompt and LangChain's `llm_string`, which covers the
+    model name, its parameters and any bound tools such as a `with_structured_output`
+    schema, so a hit is only returned for an identical call.
+    """
+    def __init__(
+        self,
+        database_path,
+        max_entries=10000,
+        ttl=None,
+        ):
+        """
+        Args:
+            database_path (str): Path to the SQLite file. Created if missing.
+            max_entries (int): The maximum number of cached responses; the least
+                               recently used entries are evicted beyond it.
+            ttl (float, optional): Seconds after which an entry expires. None keeps entries forever.
+        """
+        self.database_path = database_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        database_dir = os.path.dirname(database_path)
+        if database_dir:
+            os.makedirs(database_dir, exist_ok=True)
+        self._conn = sqlite3.connect(database_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                llm_string TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at_idx ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return loads(row[0])
+
+    def update(self, prompt, llm_string, return_val):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO llm_cache (key, llm_string, prompt, value, created_at, accessed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                (self._key(prompt, llm_string), llm_string, prompt, dumps(return_val), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl is not None:
+            cursor = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            self.evictions += cursor.rowcount
+        # 최대 개수를 넘으면 가장 오래 사용되지 않은 항목부터 삭제
+        cursor = self._conn.execute(
+            """DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+        self.evictions += cursor.rowcount
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self):
+        """Returns the number of cached responses and hit/miss/eviction counters."""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
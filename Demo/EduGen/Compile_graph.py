@@ -5,30 +5,51 @@ from Nodes import extract_requirements_node
 from Nodes import retrieve_from_db_node
 from Nodes import generate_learning_goals_node
 from Nodes import generate_problems_node
+from Nodes import generate_combined_node
 from Nodes import consolidate_response_node
 from Nodes import grade_documents
 from Nodes import error_handler
+from Nodes import lookup_basecode_node
 from Edges import route_retrieve_metadata
+from Edges import route_after_extraction
+from Edges import route_entry
+from Edges import route_content_generation
+from Edges import route_retrieval_only
+from Metrics import instrument_node
 
 def get_compiled_graph():
     # 그래프 객체 생성
     workflow = StateGraph(MainState)
     # Add Nodes
-    workflow.add_node("extract_requirements", extract_requirements_node)
-    workflow.add_node("retrieve_from_vectordb", retrieve_from_db_node)
-    workflow.add_node("generate_learning_goals", generate_learning_goals_node)
-    workflow.add_node("generate_problems", generate_problems_node)
-    workflow.add_node("consolidate_response", consolidate_response_node)
-    workflow.add_node("evaluation_grade", grade_documents)
-    workflow.add_node("error_handler", error_handler)
+    # 모든 노드는 실행 시간과 실패 횟수를 /metrics로 집계하도록 감싸서 등록
+    workflow.add_node("extract_requirements", instrument_node("extract_requirements", extract_requirements_node))
+    workflow.add_node("retrieve_from_vectordb", instrument_node("retrieve_from_vectordb", retrieve_from_db_node))
+    workflow.add_node("lookup_basecode", instrument_node("lookup_basecode", lookup_basecode_node))
+    workflow.add_node("generate_learning_goals", instrument_node("generate_learning_goals", generate_learning_goals_node))
+    workflow.add_node("generate_problems", instrument_node("generate_problems", generate_problems_node))
+    workflow.add_node("generate_combined", instrument_node("generate_combined", generate_combined_node))
+    workflow.add_node("consolidate_response", instrument_node("consolidate_response", consolidate_response_node))
+    workflow.add_node("evaluation_grade", instrument_node("evaluation_grade", grade_documents))
+    workflow.add_node("error_handler", instrument_node("error_handler", error_handler))
 
     # Add Edges
     # 조건부 엣지로 들어가는 연결은 포함되면 안됨
     # 의도대로 동작하지 않음
     # ---------------------------
     # 병럴 노드 이전의 연결
-    workflow.set_entry_point("extract_requirements")
-    workflow.add_edge("extract_requirements", "retrieve_from_vectordb")
+    # 요구사항이 이미 주어진 요청은 추출 노드를 건너뜀
+    workflow.set_conditional_entry_point(
+        route_entry,
+        {
+            "extract_requirements": "extract_requirements",
+            "lookup_basecode": "lookup_basecode",
+            "retrieve_from_vectordb": "retrieve_from_vectordb",
+            "generate_learning_goals": "generate_learning_goals",
+            "generate_problems": "generate_problems",
+            "generate_combined": "generate_combined",
+            "error_handler": "error_handler"
+        }
+    )
     workflow.add_edge("retrieve_from_vectordb", "evaluation_grade")
 
     # 병렬 노드 후 끝 부분 연결
@@ -38,13 +59,35 @@ def get_compiled_graph():
     # Add Conditional Edges
     # 조건부 엣지: 검색 노드 이후, 라우팅 함수 결과에 따라 병렬 노드로 분기
 
+    # 성취기준 코드가 있으면 직접 조회, 없으면 벡터 검색으로 라우팅
+    workflow.add_conditional_edges(
+        "extract_requirements",
+        route_after_extraction,
+        {
+            "lookup_basecode": "lookup_basecode",
+            "retrieve_from_vectordb": "retrieve_from_vectordb"
+        }
+    )
+    # 직접 조회한 문서는 관련성 평가 없이 바로 콘텐츠 생성 노드로 분기
+    workflow.add_conditional_edges(
+        "lookup_basecode",
+        route_content_generation,
+        {
+            "generate_learning_goals": "generate_learning_goals",
+            "generate_problems": "generate_problems",
+            "generate_combined": "generate_combined"
+        }
+    )
+
     # 검색한 문서의 연관성을 검사한 후 다시 검색할 지 다음 노드로 진행할지 라우팅
     workflow.add_conditional_edges(
         "evaluation_grade",
         route_retrieve_metadata,
         {   "retrieve_from_vectordb":"retrieve_from_vectordb",
             "generate_learning_goals": "generate_learning_goals",
-            "generate_problems": "generate_problems"
+            "generate_problems": "generate_problems",
+            "generate_combined": "generate_combined",
+            "error_handler": "error_handler"
         }
     )
 
@@ -66,5 +109,44 @@ def get_compiled_graph():
             "failure": "error_handler"          # 실패하면 오류 처리 노드로
         }
     )
+    # `generate_combined`노드에서 에러 발생 처리 (두 상태의 status는 항상 같음)
+    workflow.add_conditional_edges(
+        "generate_combined",
+        lambda state: state['goal_state']['status'],
+        {
+            "success": "consolidate_response",  # 성공하면 결과를 종합하는 노드
+            "failure": "error_handler"          # 실패하면 오류 처리 노드로
+        }
+    )
     graph = workflow.compile()
-    return graph
\ No newline at end of file
+    return graph
+
+def get_retrieval_graph():
+    """
+    요구사항이 주어진 상태에서 검색(또는 basecode 직접 조회)과 관련성 평가만 수행하는 그래프
+    배치 처리에서 같은 학교급/학년/과목/주제의 프롬프트들이 검색 결과를 공유할 때 사용합니다.
+    """
+    workflow = StateGraph(MainState)
+    workflow.add_node("retrieve_from_vectordb", instrument_node("retrieve_from_vectordb", retrieve_from_db_node))
+    workflow.add_node("lookup_basecode", instrument_node("lookup_basecode", lookup_basecode_node))
+    workflow.add_node("evaluation_grade", instrument_node("evaluation_grade", grade_documents))
+
+    workflow.set_conditional_entry_point(
+        route_after_extraction,
+        {
+            "lookup_basecode": "lookup_basecode",
+            "retrieve_from_vectordb": "retrieve_from_vectordb"
+        }
+    )
+    workflow.add_edge("retrieve_from_vectordb", "evaluation_grade")
+    workflow.add_edge("lookup_basecode", END)
+    # 관련 문서를 찾았거나 검색 횟수를 모두 사용하면 종료, 아니면 재검색
+    workflow.add_conditional_edges(
+        "evaluation_grade",
+        route_retrieval_only,
+        {
+            "retrieve_from_vectordb": "retrieve_from_vectordb",
+            END: END
+        }
+    )
+    return workflow.compile()
@@ -0,0 +1,425 @@
+import bisect
+import json
+import os
+import re
+import threading
+from collections import Counter
+from States import Requirements
+from Retrievers import RESULT_COLUMNS
+from Retrievers import PgVectorBackend
+from Settings import curriculum_data_path
+from Settings import basecode_index_source
+from Settings import basecode_prefix_max_rows
+
+# 교육과정 데이터(all_basecode.json)의 학교급/학년 표기
+# - 학교급: 초등, 중등, 고등
+# - 학년군: 초등 1~2, 3~4, 5~6 / 중등 1~3 / 고등 10(공통 과목, 1학년), 12(선택 과목, 2~3학년)
+SCHOOL_LEVEL_PREFIXES = (
+    ("초", "초등"),
+    ("중", "중등"),
+    ("고", "고등"),
+)
+GRADE_BANDS = {
+    "초등": {1: "1~2", 2: "1~2", 3: "3~4", 4: "3~4", 5: "5~6", 6: "5~6"},
+    "중등": {1: "1~3", 2: "1~3", 3: "1~3"},
+    "고등": {1: "10", 2: "12", 3: "12"},
+}
+SCHOOL_LEVEL_NAMES = {"초등": "초등학교", "중등": "중학교", "고등": "고등학교"}
+
+# 규칙 기반 요구사항 추출에 사용하는 패턴
+# - 학교급 + 학년: '고등학교 1학년', '중등 2학년' 또는 줄임말 '고1', '중2'
+SCHOOL_GRADE_PATTERN = re.compile(
+    r"(초등학교|초등|중학교|중등|고등학교|고등)\s*([1-6])\s*학년"
+    r"|(?<![가-힣])([초중고])([1-6])(?!\d)"
+)
+# - 학교급 없이 학년만 쓴 표현 (예: '1학년과 2학년'의 '2학년')
+GRADE_MENTION_PATTERN = re.compile(r"\d\s*학년")
+QUOTE_CHARS = "'\"‘’“”「」『』"
+QUOTED_PATTERN = re.compile(f"[{QUOTE_CHARS}]\\s*([^{QUOTE_CHARS}]+?)\\s*[{QUOTE_CHARS}]")
+# - 성취기준 코드 또는 접두어: '[2수01-01]', '[12미적Ⅱ-03-02]', '[2수01'
+BASECODE_PATTERN = re.compile(r"\[\d{1,2}[가-힣]+[0-9ⅠⅡⅢ]+(?:-\d{2})*\]?")
+# - 어휘는 어절 전체 또는 어절 + 조사일 때만 매칭 ('학생들이'의 '들이', '소수점'의 '소수'는 제외)
+VOCABULARY_PARTICLES = ("에서", "으로", "부터", "까지", "이란", "은", "는", "이", "가", "을", "를", "의", "에", "와", "과", "로", "도", "만", "란")
+CURRICULUM_SUBJECT = "수학"
+# 교육과정 데이터는 수학 과목만 포함하므로 다른 과목명이 보이면 LLM에 맡김
+OTHER_SUBJECTS = ("국어", "영어", "과학", "사회", "역사", "도덕", "음악", "미술", "체육", "기술", "가정", "정보")
+CONTENT_REQUEST_KEYWORDS = {
+    "학습 목표 생성": ("학습 목표", "학습목표", "목표"),
+    "문제 생성": ("문제", "퀴즈", "연습"),
+}
+# 콘텐츠 유형을 제외/한정하는 표현('문제는 말고', '학습 목표 없이', '문제만')이 있으면 LLM에 맡김
+CONTENT_EXCLUSION_MARKERS = ("말고", "없이", "빼고", "제외")
+CONTENT_ONLY_PATTERN = re.compile(
+    "(?:" + "|".join(
+        re.escape(keyword) for keywords in CONTENT_REQUEST_KEYWORDS.values() for keyword in keywords
+    ) + r")\s*(?:은|는)?\s*만(?!들)"
+)
+
+
+def normalize_school_level(school_level):
+    """'고등학교', '중학교', '초등' 등의 표기를 교육과정 데이터의 학교급 값으로 변환합니다."""
+    value = str(school_level or "").strip()
+    for prefix, canonical in SCHOOL_LEVEL_PREFIXES:
+        if value.startswith(prefix):
+            return canonical
+    return None
+
+
+def normalize_grade(
+    school_level,
+    grade,
+    ):
+    """'1학년' 등의 표기를 학교급에 맞는 교육과정 데이터의 학년(군) 값으로 변환합니다."""
+    bands = GRADE_BANDS.get(school_level)
+    if bands is None:
+        return None
+    value = str(grade or "").strip()
+    # 이미 데이터의 학년(군) 표기인 경우 그대로 사용
+    if value in bands.values():
+        return value
+    match = re.search(r"\d+", value)
+    if match is None:
+        return None
+    return bands.get(int(match.group()))
+
+
+def grade_label(
+    school_level,
+    grade,
+    ):
+    """교육과정 데이터의 학년(군) 값을 '1~2학년', '1학년' 등의 표기로 변환합니다."""
+    grades = sorted(num for num, band in GRADE_BANDS.get(school_level, {}).items() if band == str(grade))
+    if not grades:
+        return str(grade)
+    if len(grades) == 1:
+        return f"{grades[0]}학년"
+    return f"{grades[0]}~{grades[-1]}학년"
+
+
+def to_search_filters(requirements):
+    """
+    추출된 요구사항에서 벡터 검색 전에 적용할 메타데이터 필터를 만듭니다.
+    해석할 수 없는 값은 필터에서 제외합니다.
+    """
+    filters = {}
+    school_level = normalize_school_level(requirements.school_level)
+    if school_level is None:
+        return filters
+    filters["school_level"] = school_level
+
+    grade = normalize_grade(school_level, requirements.grade)
+    if grade is not None:
+        filters["grade"] = grade
+    return filters
+
+
+def retrieval_group_key(requirements):
+    """
+    검색 결과를 공유할 수 있는 요구사항끼리 같은 값을 갖는 키를 만듭니다.
+    학교급/학년은 교육과정 데이터 표기로 정규화하고, 콘텐츠 유형은 검색과 무관하므로 제외합니다.
+    """
+    def _normalize(value):
+        return " ".join(str(value or "").split()).lower()
+
+    school_level = normalize_school_level(requirements.school_level)
+    grade = normalize_grade(school_level, requirements.grade)
+    return (
+        school_level or _normalize(requirements.school_level),
+        grade or _normalize(requirements.grade),
+        _normalize(requirements.subject),
+        _normalize(requirements.domain),
+        _normalize(requirements.basecode),
+    )
+
+
+class BasecodeIndex:
+    """
+    성취기준 코드(basecode)로 교육과정 행을 바로 찾기 위한 메모리 인덱스입니다.
+    정확한 코드('[2수01-01]')와 코드 접두어('[2수01')를 모두 지원합니다.
+    """
+    def __init__(
+        self,
+        records,
+        prefix_max_rows=basecode_prefix_max_rows,
+        ):
+        """
+        Args:
+            records (list[dict]): basecode를 포함한 교육과정 행 목록
+            prefix_max_rows (int): 접두어 조회 결과가 이보다 많으면 너무 넓은 조회로 보고 사용하지 않음
+        """
+        # 벡터 검색 결과와 같은 형태(RESULT_COLUMNS, 문자열 값)로 저장
+        rows = [
+            {col: str(record[col]) for col in RESULT_COLUMNS}
+            for record in records
+        ]
+        self.rows = {row["basecode"]: row for row in rows}
+        self.sorted_codes = sorted(self.rows)
+        self.prefix_max_rows = prefix_max_rows
+
+    @classmethod
+    def from_json(cls, data_path=curriculum_data_path, **kwargs):
+        with open(data_path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    @classmethod
+    def from_db(cls, table_name="curriculum", **kwargs):
+        return cls(PgVectorBackend(table_name).fetch_all(), **kwargs)
+
+    @staticmethod
+    def normalize(code):
+        """공백을 제거하고 여는 괄호를 붙여 코드 표기를 맞춥니다."""
+        code = "".join(str(code or "").split())
+        if code and not code.startswith("["):
+            code = "[" + code
+        return code
+
+    def lookup(self, code):
+        """
+        코드와 정확히 일치하는 행, 또는 코드로 시작하는 행 목록을 반환합니다.
+        일치하는 행이 없거나 접두어 조회 결과가 너무 많으면 빈 리스트를 반환합니다.
+        """
+        code = self.normalize(code)
+        # '[2수'처럼 단원 번호가 없는 접두어는 범위가 너무 넓으므로 조회하지 않음
+        if not BASECODE_PATTERN.fullmatch(code):
+            return []
+        if code in self.rows:
+            return [dict(self.rows[code])]
+        # '[2수01]', '[12미적Ⅱ-03]'처럼 닫힌 단원 코드는 닫는 괄호를 뗀 접두어로 조회
+        if code.endswith("]"):
+            code = code[:-1]
+        start = bisect.bisect_left(self.sorted_codes, code)
+        matched = []
+        for basecode in self.sorted_codes[start:]:
+            if not basecode.startswith(code):
+                break
+            matched.append(dict(self.rows[basecode]))
+            if len(matched) > self.prefix_max_rows:
+                return []
+        return matched
+
+    def find_in_text(self, text):
+        """텍스트에 포함된 코드(또는 접두어)를 찾아 일치하는 행 목록을 반환합니다."""
+        for match in BASECODE_PATTERN.finditer(str(text or "")):
+            rows = self.lookup(match.group())
+            if rows:
+                return rows
+        return []
+
+    def to_requirements(self, rows, content_requests):
+        """조회된 행의 학교급/학년/영역으로 Requirements를 만듭니다."""
+        first = rows[0]
+        categories = {row["category"] for row in rows}
+        school_level = normalize_school_level(first["school_level"])
+        return Requirements(
+            school_level=SCHOOL_LEVEL_NAMES.get(school_level, first["school_level"]),
+            grade=grade_label(school_level, first["grade"]),
+            subject=CURRICULUM_SUBJECT,
+            content_requests=content_requests,
+            # 한 내용 요소만 가리키면 내용 요소를, 여러 요소에 걸치면 영역을 주제로 사용
+            domain=first["category"] if len(categories) == 1 else first["domain"],
+            basecode=first["basecode"] if len(rows) == 1 else self._common_prefix(rows),
+        )
+
+    @staticmethod
+    def _common_prefix(rows):
+        # 접두어 조회 결과의 공통 코드 단위(예: '[4수02-0'이 아닌 '[4수02')
+        prefix = os.path.commonprefix([row["basecode"] for row in rows])
+        return prefix.rsplit("-", 1)[0] if "-" in prefix else prefix
+
+
+_basecode_index = None
+_basecode_index_lock = threading.Lock()
+
+
+def get_basecode_index():
+    """BASECODE_INDEX_SOURCE(json 또는 db)에서 만든 프로세스 전체 basecode 인덱스를 반환합니다."""
+    global _basecode_index
+    with _basecode_index_lock:
+        if _basecode_index is None:
+            if basecode_index_source == "db":
+                _basecode_index = BasecodeIndex.from_db()
+            else:
+                _basecode_index = BasecodeIndex.from_json()
+        return _basecode_index
+
+
+def find_basecode_rows(
+    requirements,
+    prompt=None,
+    ):
+    """요구사항의 basecode, 없으면 프롬프트에 포함된 코드로 교육과정 행을 조회합니다."""
+    index = get_basecode_index()
+    rows = index.lookup(requirements.basecode) if getattr(requirements, "basecode", None) else []
+    return rows or index.find_in_text(prompt)
+
+
+class RuleBasedRequirementsExtractor:
+    """
+    교육과정 데이터의 영역/내용 요소 어휘와 정규식으로 프롬프트에서 요구사항을 추출합니다.
+    학교급, 학년, 주제를 모두 확실하게 찾은 경우에만 Requirements를 반환하고,
+    그 외에는 None을 반환하여 LLM 추출로 넘깁니다.
+    """
+    def __init__(
+        self,
+        data_path=curriculum_data_path,
+        ):
+        """
+        Args:
+            data_path (str): 교육과정 원본 데이터(all_basecode.json) 경로
+        """
+        with open(data_path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        terms = {
+            str(record[col]).strip()
+            for record in records
+            for col in ("domain", "category")
+            if record.get(col)
+        }
+        # 겹치는 어휘(예: '경우의 수', '경우의 수와 확률') 중 가장 긴 것을 우선 매칭
+        self.vocabulary = sorted(terms, key=len, reverse=True)
+        particles = "|".join(VOCABULARY_PARTICLES)
+        self._term_patterns = [
+            (term, re.compile(f"(?<![가-힣]){re.escape(term)}(?:{particles})?(?![가-힣])"))
+            for term in self.vocabulary
+        ]
+        # 여러 어절 어휘의 마지막 어절(예: '다각형의 둘레와 넓이'의 '넓이')은 어휘가 아니지만 주제일 수 있으므로,
+        # 어휘와 함께 나오면('넓이 문제, 길이도 포함') 판단하지 않음
+        # (과목명, 콘텐츠 요청 키워드, 한 글자 단어처럼 주제가 아닌 일반 단어는 제외)
+        generic_words = {CURRICULUM_SUBJECT, *(keyword for keywords in CONTENT_REQUEST_KEYWORDS.values() for keyword in keywords)}
+        head_words = {
+            word for word in (term.split()[-1] for term in terms if " " in term)
+            if len(word) > 1 and word not in generic_words
+        } - terms
+        self._head_word_patterns = [
+            re.compile(f"(?<![가-힣]){re.escape(word)}(?:{particles})?(?![가-힣])")
+            for word in sorted(head_words, key=len, reverse=True)
+        ]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.miss_reasons = Counter()
+
+    def _school_and_grade(self, prompt):
+        found = set()
+        for long_level, long_grade, short_level, short_grade in SCHOOL_GRADE_PATTERN.findall(prompt):
+            school_level = normalize_school_level(long_level or short_level)
+            found.add((school_level, int(long_grade or short_grade)))
+        # 학교급/학년이 없거나 서로 다른 값이 여러 개이면 판단하지 않음
+        if len(found) != 1:
+            return None
+        # 학교급 없이 학년만 쓴 표현이 더 있으면(예: '고등학교 1학년과 2학년') 판단하지 않음
+        if GRADE_MENTION_PATTERN.search(SCHOOL_GRADE_PATTERN.sub(" ", prompt)):
+            return None
+        school_level, grade = found.pop()
+        if normalize_grade(school_level, grade) is None:
+            return None
+        return school_level, grade
+
+    def _domain(self, prompt):
+        # 따옴표로 감싼 주제나 어휘가 서로 다른 값으로 여러 개 있으면 판단하지 않음
+        quoted = set(QUOTED_PATTERN.findall(prompt))
+        if quoted:
+            return (quoted.pop(), False) if len(quoted) == 1 else (None, False)
+        matched, spans = set(), []
+        for term, pattern in self._term_patterns:
+            for match in pattern.finditer(prompt):
+                # 이미 매칭된 더 긴 어휘 안에 포함된 짧은 어휘는 무시
+                if any(start <= match.start() and match.end() <= end for start, end in spans):
+                    continue
+                spans.append(match.span())
+                matched.add(term)
+        if len(matched) != 1:
+            return None, False
+        for pattern in self._head_word_patterns:
+            for match in pattern.finditer(prompt):
+                if not any(start <= match.start() and match.end() <= end for start, end in spans):
+                    return None, False
+        return matched.pop(), True
+
+    @staticmethod
+    def _content_requests(prompt):
+        """요청한 콘텐츠 유형을 반환합니다. 제외/한정 표현이 있어 확실하지 않으면 None을 반환합니다."""
+        if any(marker in prompt for marker in CONTENT_EXCLUSION_MARKERS) or CONTENT_ONLY_PATTERN.search(prompt):
+            return None
+        requests = [
+            request for request, keywords in CONTENT_REQUEST_KEYWORDS.items()
+            if any(keyword in prompt for keyword in keywords)
+        ]
+        # 콘텐츠 유형을 지정하지 않으면 학습 목표와 문제를 모두 생성
+        return requests or list(CONTENT_REQUEST_KEYWORDS)
+
+    def _parse(self, prompt):
+        # 성취기준 코드가 있으면 해당 행의 메타데이터로 바로 채움
+        basecode_rows = get_basecode_index().find_in_text(prompt)
+        if basecode_rows:
+            content_requests = self._content_requests(BASECODE_PATTERN.sub(" ", prompt))
+            if content_requests is None:
+                return None, "content_request"
+            return get_basecode_index().to_requirements(basecode_rows, content_requests), None
+
+        school_and_grade = self._school_and_grade(prompt)
+        if school_and_grade is None:
+            return None, "school_grade"
+        domain, from_vocabulary = self._domain(prompt)
+        if not domain:
+            return None, "domain"
+        # 주제 표현 자체에 포함된 단어(예: '사회와 수학')는 과목/요청 유형 판단에서 제외
+        rest = prompt.replace(domain, " ")
+        if any(subject in rest for subject in OTHER_SUBJECTS):
+            return None, "subject"
+        if CURRICULUM_SUBJECT not in prompt and not from_vocabulary:
+            return None, "subject"
+        content_requests = self._content_requests(rest)
+        if content_requests is None:
+            return None, "content_request"
+
+        school_level, grade = school_and_grade
+        requirements = Requirements(
+            school_level=SCHOOL_LEVEL_NAMES[school_level],
+            grade=f"{grade}학년",
+            subject=CURRICULUM_SUBJECT,
+            content_requests=content_requests,
+            domain=domain,
+            basecode="",
+        )
+        return requirements, None
+
+    def extract(self, prompt, record_stats=True):
+        """
+        프롬프트에서 요구사항을 추출합니다. 확실하지 않으면 None을 반환합니다.
+        record_stats가 False이면(서버 워밍업 등) 추출 경로 통계에 반영하지 않습니다.
+        """
+        requirements, reason = self._parse(str(prompt or ""))
+        if not record_stats:
+            return requirements
+        with self._lock:
+            if requirements is None:
+                self.misses += 1
+                self.miss_reasons[reason] += 1
+            else:
+                self.hits += 1
+        return requirements
+
+    def stats(self):
+        """규칙 기반 추출 성공(fast path) 및 LLM 대체 횟수와 커버리지를 반환합니다."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "fast_path": self.hits,
+                "llm_fallback": self.misses,
+                "fallback_reasons": dict(self.miss_reasons),
+                "coverage": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+
+def get_requirements_extractor():
+    """프로세스 전체에서 공유하는 규칙 기반 요구사항 추출기를 반환합니다."""
+    global _extractor
+    with _extractor_lock:
+        if _extractor is None:
+            _extractor = RuleBasedRequirementsExtractor()
+        return _extractor
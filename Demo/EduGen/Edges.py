@@ -1,31 +1,89 @@
+import logging
+from langgraph.graph import END
 from States import MainState
 from typing import List
+from typing import Optional
+from langchain_core.runnables import RunnableConfig
+from Settings import max_retrieval_attempts
+from Settings import combined_generation
+from Curriculum import find_basecode_rows
 
-def route_content_generation(state: MainState) -> List[str]:
+logger = logging.getLogger(__name__)
+
+def _combined_generation_enabled(config):
+    configurable = (config or {}).get("configurable") or {}
+    return configurable.get("combined_generation", combined_generation)
+
+def route_content_generation(state: MainState, config: Optional[RunnableConfig] = None) -> List[str]:
     """
     사용자의 요청에 따라 다음에 실행할 콘텐츠 생성 노드를 결정합니다.
     - 리스트를 반환하여 여러 노드를 병렬로 실행시킬 수 있습니다.
+    - 학습 목표와 문제를 모두 요청하고 통합 생성이 켜져 있으면 한 번의 호출로 함께 생성합니다.
     """
-    print("\n--- 라우팅: 생성할 콘텐츠 결정 ---")
     content_requests = state["requirements"].content_requests
     
     next_nodes = []
-    if "학습 목표 생성" in content_requests:
-        next_nodes.append("generate_learning_goals")
-    if "문제 생성" in content_requests:
-        next_nodes.append("generate_problems")
+    if (
+        "학습 목표 생성" in content_requests
+        and "문제 생성" in content_requests
+        and _combined_generation_enabled(config)
+    ):
+        next_nodes.append("generate_combined")
+    else:
+        if "학습 목표 생성" in content_requests:
+            next_nodes.append("generate_learning_goals")
+        if "문제 생성" in content_requests:
+            next_nodes.append("generate_problems")
     
-    print(f"-> 다음 노드(병렬 실행): {next_nodes}")
+    logger.info("콘텐츠 생성 노드 라우팅", extra={"next_nodes": next_nodes})
     return next_nodes
 
-def route_retrieve_metadata(state: MainState):
+def route_retrieve_metadata(state: MainState, config: Optional[RunnableConfig] = None):
     """
     학년 메타데이터 검증의 결과값을 바탕으로 다음 노드로 진행할건지 다시 검색할지 결정합니다
+    최대 검색 횟수를 모두 사용했으면 오류 처리 노드로 이동합니다
     """
     binary_score = state["binary_score"]
     
     if binary_score == "yes":
-        next_node = route_content_generation(state)
+        next_node = route_content_generation(state, config)
+    elif state.get("retrieval_attempt", 0) >= max_retrieval_attempts:
+        logger.warning("최대 검색 횟수 초과, 오류 처리 노드로 이동", extra={"max_retrieval_attempts": max_retrieval_attempts})
+        next_node = "error_handler"
     else:
         next_node = "retrieve_from_vectordb"
-    return next_node
\ No newline at end of file
+    return next_node
+
+def route_after_extraction(state: MainState) -> str:
+    """
+    요구사항이나 프롬프트에 교육과정에 있는 성취기준 코드가 있으면 직접 조회 노드로,
+    없으면 벡터 검색 노드로 이동합니다.
+    """
+    if find_basecode_rows(state["requirements"], state.get("prompt")):
+        logger.info("성취기준 코드 발견, 벡터 검색과 관련성 평가 생략")
+        return "lookup_basecode"
+    return "retrieve_from_vectordb"
+
+def route_entry(state: MainState, config: Optional[RunnableConfig] = None):
+    """
+    요구사항이 입력으로 함께 주어지면(서빙 계층에서 미리 추출한 경우) 요구사항 추출 노드를 건너뛰고
+    바로 검색 경로를 결정합니다.
+    검색과 관련성 평가 결과(binary_score)까지 주어지면(배치 처리에서 공유한 검색 결과)
+    바로 콘텐츠 생성 또는 오류 처리 노드로 이동합니다.
+    """
+    if state.get("requirements") is None:
+        return "extract_requirements"
+    if state.get("binary_score") == "yes" and state.get("retrieved_docs"):
+        return route_content_generation(state, config)
+    if state.get("binary_score") == "no":
+        return "error_handler"
+    return route_after_extraction(state)
+
+def route_retrieval_only(state: MainState) -> str:
+    """
+    배치 처리용 검색 전용 그래프에서 관련성 평가 후 다시 검색할지 종료할지 결정합니다.
+    관련 문서를 찾았거나 최대 검색 횟수를 모두 사용하면 종료합니다.
+    """
+    if state["binary_score"] == "yes" or state.get("retrieval_attempt", 0) >= max_retrieval_attempts:
+        return END
+    return "retrieve_from_vectordb"
@@ -1,26 +1,109 @@
+import asyncio
+import logging
+import re
+import time
 from langchain_core.prompts import ChatPromptTemplate
 from States import GradeDocuments
+from Caches import LRUCache
+from Utils import get_embedding_model
+from Retrievers import PgVectorBackend
+from Retrievers import get_retrieval_backend
+from Curriculum import to_search_filters
+from Settings import embedding_model_name
+from Settings import query_embedding_cache_size
+from Settings import query_embedding_cache_ttl
+from Settings import grader_max_concurrency
+from Settings import grade_verdict_cache_size
+from Settings import grade_verdict_cache_ttl
+from Settings import context_token_budget
+from Metrics import EMBEDDING_DURATION_SECONDS
+from Metrics import CONTEXT_TOKENS
+from Metrics import CONTEXT_DOCS_DROPPED
+
+logger = logging.getLogger(__name__)
+
+# 동일한 메타데이터 문자열은 모델 추론 없이 재사용하기 위한 쿼리 임베딩 캐시
+query_embedding_cache = LRUCache(
+    maxsize=query_embedding_cache_size,
+    ttl=query_embedding_cache_ttl,
+)
+# (정규화된 메타데이터, basecode) 쌍별 관련성 평가 결과 캐시 (요청/스레드 간 공유)
+grade_verdict_cache = LRUCache(
+    maxsize=grade_verdict_cache_size,
+    ttl=grade_verdict_cache_ttl,
+)
+
+def embed_query(
+    text,
+    model_name=embedding_model_name,
+    ):
+    """메타데이터 문자열을 임베딩합니다. 같은 문자열은 캐시된 벡터를 반환합니다."""
+    def _encode():
+        start = time.perf_counter()
+        vector = get_embedding_model(model_name).encode(text)
+        EMBEDDING_DURATION_SECONDS.observe(time.perf_counter() - start, model=model_name)
+        # 캐시된 벡터가 호출자에 의해 변경되지 않도록 읽기 전용으로 설정
+        vector.setflags(write=False)
+        return vector
+
+    return query_embedding_cache.get_or_compute((model_name, text), _encode)
+
 
 def search_metadata(
     vector,
-    conn,
+    conn=None,
     k=3,
+    filters=None,
+    exclude=None,
     ):
-    """pgvector에서 관련성 높은 문서를 k개 검색합니다."""
-    with conn.cursor() as cursor:
-        # 벡터 검색 시 필요한 모든 컬럼을 가져옵니다.
-        cursor.execute(
-            """SELECT basecode, content,school_level, grade, domain, category
-                FROM curriculum
-                ORDER BY embedding <=> %s::vector LIMIT %s""",
-            (list(vector), k)
-        )
-        # 결과를 딕셔너리 리스트로 변환
-        results = [
-            dict(zip([desc[0] for desc in cursor.description], row))
-            for row in cursor.fetchall()
-        ]
-        return results
+    """
+    설정된 검색 백엔드(pgvector 또는 메모리 인덱스)에서 관련성 높은 문서를 k개 검색합니다.
+    conn을 지정하면 해당 연결로 pgvector를 직접 검색합니다.
+    filters를 지정하면 해당 메타데이터(예: 학교급, 학년)와 일치하는 문서 중에서만 검색합니다.
+    exclude에 지정한 basecode의 문서는 결과에서 제외합니다.
+    """
+    if conn is not None:
+        return PgVectorBackend().search(vector, k=k, conn=conn, filters=filters, exclude=exclude)
+    return get_retrieval_backend().search(vector, k=k, filters=filters, exclude=exclude)
+
+def search_metadata_filtered(
+    vector,
+    requirements,
+    k=3,
+    exclude=None,
+    ):
+    """
+    추출된 요구사항의 학교급/학년으로 검색 대상을 먼저 좁힌 뒤 벡터 검색합니다.
+    필터에 맞는 문서가 없으면 필터 없이 다시 검색합니다.
+    """
+    filters = to_search_filters(requirements)
+    if filters:
+        results = search_metadata(vector, k=k, filters=filters, exclude=exclude)
+        if results:
+            return results
+        logger.info("필터에 맞는 문서가 없어 전체에서 검색", extra={"filters": filters})
+    return search_metadata(vector, k=k, exclude=exclude)
+
+def lookup_metadata(
+    requirements,
+    k=3,
+    exclude=None,
+    ):
+    """
+    벡터 검색 없이 학교급/학년 필터와 영역(domain) 키워드로 문서를 조회합니다.
+    벡터 검색 결과가 계속 관련 없다고 평가될 때 마지막 재검색 수단으로 사용합니다.
+    키워드에 맞는 문서가 없으면 학교급/학년 필터만으로 조회합니다.
+    """
+    backend = get_retrieval_backend()
+    filters = to_search_filters(requirements)
+    keyword = str(requirements.domain or "").strip() or None
+    if keyword:
+        results = backend.lookup(filters=filters, keyword=keyword, k=k, exclude=exclude)
+        if results:
+            return results
+        logger.info("키워드에 맞는 문서가 없어 필터로만 조회", extra={"keyword": keyword, "filters": filters})
+    return backend.lookup(filters=filters, k=k, exclude=exclude)
+
 def get_grader(llm):
     # GradeDocuments 데이터 모델을 사용하여 LLM의 구조화된 출력 생성
     structured_llm_grader = llm.with_structured_output(GradeDocuments)
@@ -41,4 +124,151 @@ def get_grader(llm):
 
     # 검색 평가기 생성
     retrieval_grader = grade_prompt | structured_llm_grader
-    return retrieval_grader
\ No newline at end of file
+    return retrieval_grader
+
+def normalize_metadata(metadata):
+    """평가 결과 캐시 키로 사용하기 위해 메타데이터 문자열의 공백과 대소문자를 정규화합니다."""
+    return " ".join(str(metadata).split()).lower()
+
+def _verdict_key(question, doc):
+    basecode = doc.get("basecode")
+    if not basecode:
+        return None
+    return (normalize_metadata(question), basecode)
+
+async def grade_documents_concurrently(
+    retrieval_grader,
+    question,
+    documents,
+    threshold,
+    max_concurrency=grader_max_concurrency,
+    verdict_cache=None,
+    ):
+    """
+    문서별 관련성 평가를 최대 max_concurrency개까지 동시에 실행합니다.
+    통과 기준(threshold)을 이미 충족했거나 더 이상 충족할 수 없으면
+    남은 평가 호출은 보내지 않고 취소합니다.
+    verdict_cache를 지정하면 (메타데이터, basecode) 쌍의 이전 평가 결과를 재사용하고
+    처음 보는 쌍만 평가기에 보냅니다.
+
+    Returns:
+        tuple: (관련 있다고 평가된 문서 리스트, 관련 없다고 평가된 문서 리스트,
+                실제로 평가기를 호출한 문서 수)
+    """
+    relevant_docs = []
+    rejected_docs = []
+    uncached_docs = []
+    for doc in documents:
+        key = _verdict_key(question, doc)
+        grade = verdict_cache.get(key) if verdict_cache is not None and key is not None else None
+        if grade is None:
+            uncached_docs.append(doc)
+        elif grade == "yes":
+            relevant_docs.append(doc)
+        else:
+            rejected_docs.append(doc)
+    cached = len(documents) - len(uncached_docs)
+    if cached:
+        logger.debug("캐시된 평가 결과 사용", extra={"cached": cached, "relevant": len(relevant_docs)})
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _grade(doc):
+        async with semaphore:
+            joined_doc = " ".join(str(val) for val in doc.values())
+            score = await retrieval_grader.ainvoke(
+                {"question": question, "document": joined_doc}
+            )
+            grade = score.binary_score
+            key = _verdict_key(question, doc)
+            if verdict_cache is not None and key is not None:
+                verdict_cache.set(key, grade)
+            return doc, grade
+
+    def _decided(remaining):
+        return len(relevant_docs) >= threshold or len(relevant_docs) + remaining < threshold
+
+    if _decided(len(uncached_docs)):
+        return relevant_docs, rejected_docs, 0
+
+    tasks = [asyncio.create_task(_grade(doc)) for doc in uncached_docs]
+    graded = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            doc, grade = await next_done
+            graded += 1
+            logger.debug("문서 관련성 평가", extra={"basecode": doc.get("basecode"), "grade": grade})
+            if grade == "yes":
+                relevant_docs.append(doc)
+            else:
+                rejected_docs.append(doc)
+
+            if _decided(len(uncached_docs) - graded):
+                break
+    finally:
+        # 결과가 확정되면 대기 중이거나 실행 중인 평가 호출을 취소
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return relevant_docs, rejected_docs, graded
+
+HANGUL_PATTERN = re.compile(r"[가-힣]")
+
+def estimate_tokens(text):
+    """
+    토크나이저 없이 토큰 수를 근사합니다.
+    한글은 글자당 약 1토큰, 그 외 문자(영문, 숫자, 기호, 공백)는 4글자당 약 1토큰으로 계산합니다.
+    """
+    hangul = len(HANGUL_PATTERN.findall(text))
+    return hangul + (len(text) - hangul + 3) // 4
+
+def _format_doc(doc):
+    """Reference/17-LangGraph의 rag/utils.py format_docs와 같이 문서 하나를 <document> 레코드 한 줄로 만듭니다."""
+    # 출처: 학교급/학년/영역(범주가 영역과 다를 때만 범주까지)
+    source = [str(doc[key]) for key in ("school_level", "grade", "domain") if doc.get(key)]
+    if doc.get("category") and doc["category"] != doc.get("domain"):
+        source.append(str(doc["category"]))
+    return (
+        f"<document><basecode>{doc.get('basecode') or ''}</basecode>"
+        f"<content>{str(doc.get('content') or '').strip()}</content>"
+        f"<source>{' | '.join(source)}</source></document>"
+    )
+
+def format_docs(docs, token_budget=context_token_budget):
+    """
+    검색된 교육과정 문서를 생성 프롬프트용 참고 자료 문자열로 만듭니다.
+    - 문서마다 `<document><basecode>…</basecode><content>…</content><source>…</source></document>` 한 줄을 만듭니다.
+    - basecode(없으면 내용)가 같은 문서는 한 번만 넣습니다.
+    - 검색 순위대로 넣다가 추정 토큰 수가 `token_budget`을 넘으면 그 이후 문서는 모두 생략합니다.
+      (첫 문서는 예산과 관계없이 항상 포함, 0 이하이면 제한 없음)
+    """
+    records = []
+    seen = set()
+    used = 0
+    duplicates = over_budget = 0
+    for doc in docs or []:
+        key = doc.get("basecode") or doc.get("content")
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        if over_budget:
+            over_budget += 1
+            continue
+        record = _format_doc(doc)
+        cost = estimate_tokens(record)
+        if records and token_budget > 0 and used + cost > token_budget:
+            over_budget += 1
+            continue
+        records.append(record)
+        used += cost
+
+    if duplicates:
+        CONTEXT_DOCS_DROPPED.inc(duplicates, reason="duplicate")
+    if over_budget:
+        CONTEXT_DOCS_DROPPED.inc(over_budget, reason="token_budget")
+        logger.info("토큰 예산 초과로 참고 자료 일부 생략", extra={"dropped": over_budget, "token_budget": token_budget})
+    CONTEXT_TOKENS.observe(used)
+    return "\n".join(records)
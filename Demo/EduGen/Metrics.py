@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+# 지연 시간 히스토그램의 기본 버킷 (단위: 초)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing counter with optional labels."""
+    kind = "counter"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram:
+    """A cumulative-bucket histogram with optional labels, as exposed by Prometheus."""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        buckets=DEFAULT_BUCKETS,
+        ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels):
+        """Returns the count and sum of the series for `labels`."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                return {"count": 0, "sum": 0.0}
+            return {"count": series["count"], "sum": series["sum"]}
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, dict(series, counts=list(series["counts"]))) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process metrics and renders them in the Prometheus text format."""
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Returns every registered metric in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+NODE_DURATION_SECONDS = registry.histogram(
+    "edugen_node_duration_seconds", "Wall time spent in each graph node.", ["node"]
+)
+NODE_ERRORS = registry.counter(
+    "edugen_node_errors", "Graph node executions that raised an exception.", ["node"]
+)
+LLM_TOKENS = registry.counter(
+    "edugen_llm_tokens", "LLM tokens reported by the model, by direction.", ["model", "type"]
+)
+LLM_CALLS = registry.counter(
+    "edugen_llm_calls", "Completed LLM calls.", ["model"]
+)
+EMBEDDING_DURATION_SECONDS = registry.histogram(
+    "edugen_embedding_duration_seconds", "Query embedding inference time (cache misses only).", ["model"]
+)
+DB_QUERY_DURATION_SECONDS = registry.histogram(
+    "edugen_db_query_duration_seconds", "Retrieval query time, by backend and operation.", ["backend", "operation"]
+)
+DB_POOL_WAIT_SECONDS = registry.histogram(
+    "edugen_db_pool_wait_seconds", "Time spent waiting for a pooled database connection."
+)
+GRADER_CALLS = registry.histogram(
+    "edugen_grader_calls", "Grader LLM calls issued per grading step.", buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24)
+)
+GRADER_CACHED_VERDICTS = registry.counter(
+    "edugen_grader_cached_verdicts", "Document verdicts served from the grade verdict cache."
+)
+RETRIEVAL_ATTEMPTS = registry.counter(
+    "edugen_retrieval_attempts", "Retrieval node executions, by strategy.", ["strategy"]
+)
+
+CONTEXT_TOKENS = registry.histogram(
+    "edugen_context_tokens", "Estimated tokens of the reference context sent to generation prompts.",
+    buckets=(50, 100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000)
+)
+CONTEXT_DOCS_DROPPED = registry.counter(
+    "edugen_context_docs_dropped", "Retrieved documents left out of generation prompts, by reason.", ["reason"]
+)
+GENERATION_CALLS = registry.counter(
+    "edugen_generation_calls", "Content generation LLM calls, by mode (split or combined).", ["mode"]
+)
+
+STARTUP_DURATION_SECONDS = registry.histogram(
+    "edugen_startup_duration_seconds", "Server startup phase duration (module import and each warmup stage).", ["phase"]
+)
+WARMUP_FAILURES = registry.counter(
+    "edugen_warmup_failures", "Failed warmup attempts, by stage.", ["stage"]
+)
+
+COALESCED_REQUESTS = registry.counter(
+    "edugen_coalesced_requests", "Requests that attached to an identical in-flight execution, by key stage.", ["stage"]
+)
+GRAPH_EXECUTIONS = registry.counter(
+    "edugen_graph_executions", "Graph executions started by the serving layer, by endpoint.", ["endpoint"]
+)
+
+
+def instrument_node(name, node):
+    """
+    Wraps a graph node so that its wall time and failures are recorded under `name`.
+    Async nodes stay async so the graph keeps running them on the event loop.
+    """
+    if asyncio.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await node(*args, **kwargs)
+            except Exception:
+                NODE_ERRORS.inc(node=name)
+                raise
+            finally:
+                NODE_DURATION_SECONDS.observe(time.perf_counter() - start, node=name)
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return node(*args, **kwargs)
+        except Exception:
+            NODE_ERRORS.inc(node=name)
+            raise
+        finally:
+            NODE_DURATION_SECONDS.observe(time.perf_counter() - start, node=name)
+    return wrapper
+
+
+class TokenUsageCallbackHandler(BaseCallbackHandler):
+    """Counts LLM calls and input/output tokens from the usage metadata of each generation."""
+    def on_llm_end(self, response, **kwargs):
+        model = (response.llm_output or {}).get("model_name") or "unknown"
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                if model == "unknown":
+                    model = (getattr(message, "response_metadata", None) or {}).get("model_name") or model
+                LLM_TOKENS.inc(usage.get("input_tokens", 0), model=model, type="input")
+                LLM_TOKENS.inc(usage.get("output_tokens", 0), model=model, type="output")
+        LLM_CALLS.inc(model=model)
+
+
+token_usage_handler = TokenUsageCallbackHandler()
@@ -1,26 +1,72 @@
 # Define nodes
+import asyncio
+import logging
+import threading
+from langchain_core.messages import AIMessage
 from langchain_core.prompts import ChatPromptTemplate
-from sentence_transformers import SentenceTransformer
 from States import MainState
 from States import Requirements
+from States import GeneratedContent
 from Helper_functions import search_metadata
+from Helper_functions import search_metadata_filtered
+from Helper_functions import lookup_metadata
+from Helper_functions import embed_query
 from Helper_functions import get_grader
+from Helper_functions import grade_documents_concurrently
+from Helper_functions import grade_verdict_cache
+from Helper_functions import format_docs
 from Utils import init_llm
-from Utils import postgres_conn
-from Settings import embedding_model_name
+from Curriculum import get_requirements_extractor
+from Curriculum import find_basecode_rows
+from Settings import grade_pass_ratio
+from Settings import retrieval_use_filters
+from Settings import retrieval_k
+from Settings import retrieval_widen_factor
+from Settings import max_retrieval_attempts
+from Settings import rule_based_extraction
+from Metrics import GRADER_CALLS
+from Metrics import GENERATION_CALLS
+from Metrics import GRADER_CACHED_VERDICTS
+from Metrics import RETRIEVAL_ATTEMPTS
 
-llm = init_llm()
-db_conn = postgres_conn()
+logger = logging.getLogger(__name__)
 
-def extract_requirements_node(state: MainState) -> dict:
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """
+    노드에서 공유하는 LLM을 반환합니다.
+    import 시점이 아니라 최초 사용(또는 서버 시작 시 워밍업) 시점에 생성합니다.
+    """
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = init_llm()
+        return _llm
+
+def set_llm(llm):
+    """노드에서 사용할 LLM을 교체합니다. (벤치마크의 가짜 모델 등)"""
+    global _llm
+    with _llm_lock:
+        _llm = llm
+
+async def extract_requirements_node(state: MainState) -> dict:
     """
     사용자 프롬프트를 입력받아서 메타데이터 및 요구사항을 추출
     메타데이터는 학교급, 학년, 도메인, 카테고리가 될 수 있음
+    규칙 기반 추출기로 확실하게 해석되는 프롬프트는 LLM 호출 없이 처리
     """
     prompt = state["prompt"]
 
+    if rule_based_extraction:
+        extracted = get_requirements_extractor().extract(prompt)
+        if extracted is not None:
+            logger.info("요구사항 추출 완료", extra={"source": "rule", "requirements": extracted.model_dump()})
+            return {"requirements": extracted}
+
     # LLM이 Pydantic 모델(Requirements)에 맞춰 구조화된 결과를 출력하도록 설정
-    structured_llm = llm.with_structured_output(Requirements)
+    structured_llm = get_llm().with_structured_output(Requirements)
     # Pydantic 모델에 정의된 Literal 값을 가져옵니다.
     allowed_requests = Requirements.model_fields['content_requests'].annotation.__args__[0].__args__
     # 결과: ('학습 목표 생성', '문제 생성')
@@ -44,19 +90,24 @@ def extract_requirements_node(state: MainState) -> dict:
     ])
     
     chain = prompt_template | structured_llm
-    extracted = chain.invoke({"prompt": prompt})
+    extracted = await chain.ainvoke({"prompt": prompt})
     
-    print(f"-> 추출된 요구사항: {extracted}")
+    logger.info("요구사항 추출 완료", extra={"source": "llm", "requirements": extracted.model_dump()})
 
     return {"requirements": extracted}
 
 
 
-def retrieve_from_db_node(state: MainState) -> dict:
+async def retrieve_from_db_node(state: MainState) -> dict:
     """
     추출된 요구사항 및 메타데이터 을 기반으로 벡터 DB에서 관련 메타데이터를 검색하는 노드
+    재검색 시에는 같은 검색을 반복하지 않고 시도 횟수에 따라 전략을 바꿈
+    - 1회차: 기본 k개 벡터 검색
+    - 2회차 이후: 관련 없다고 평가된 문서를 제외하고 k를 넓혀 벡터 검색
+    - 마지막 회차: 벡터 검색 대신 학교급/학년/영역 메타데이터로 직접 조회
     """
-    print("\n--- 2. 벡터 DB 검색 노드 실행 ---")
+    attempt = state.get("retrieval_attempt", 0) + 1
+    rejected = state.get("rejected_basecodes") or []
     requirements = state["requirements"]
     school_level = requirements.school_level
     grade = requirements.grade
@@ -64,8 +115,32 @@ def retrieve_from_db_node(state: MainState) -> dict:
     subject = requirements.subject
     
     concated_metadata = f"{school_level} {grade} {subject} {domain}"
-    model = SentenceTransformer(embedding_model_name)     
-    embed_metadata = model.encode(concated_metadata)
+    k = retrieval_k * retrieval_widen_factor ** (attempt - 1)
+
+    if attempt > 1 and attempt >= max_retrieval_attempts:
+        # 벡터 검색이 반복해서 실패했으므로 메타데이터로 직접 조회
+        RETRIEVAL_ATTEMPTS.inc(strategy="metadata")
+        retrieved_data = await asyncio.to_thread(
+            lookup_metadata,
+            requirements=requirements,
+            k=retrieval_k,
+            exclude=rejected,
+        )
+        logger.info("메타데이터 기반 조회 완료", extra={
+            "attempt": attempt,
+            "excluded": len(rejected),
+            "basecodes": [res.get("basecode") for res in retrieved_data],
+        })
+        return {
+            "retrieved_docs": retrieved_data,
+            "metadata": concated_metadata,
+            "retrieval_attempt": attempt,
+        }
+
+    RETRIEVAL_ATTEMPTS.inc(strategy="vector" if attempt == 1 else "widened")
+    # 재검색 루프나 반복 요청에서 같은 문자열은 캐시된 임베딩을 사용
+    # 모델 추론은 CPU 작업이므로 이벤트 루프를 막지 않도록 스레드에서 실행
+    embed_metadata = await asyncio.to_thread(embed_query, concated_metadata)
     # gemini api로 임베딩 시도했으나 실패함
     # embed_metadata = client.models.embed_content(
     #     model="gemini-embedding-001",
@@ -73,26 +148,60 @@ def retrieve_from_db_node(state: MainState) -> dict:
     #     config=types.EmbedContentConfig(output_dimensionality=1024)
     # ).embeddings[0].values
     
-    # 구축한 벡터 DB에서 검색
-    retrieved_data = search_metadata(
-        vector=embed_metadata,
-        conn=db_conn
-    )
-    print([tuple(res.values()) for res in retrieved_data])
+    # 구축한 벡터 DB에서 검색 (psycopg2는 동기 드라이버이므로 스레드에서 실행)
+    # 커넥션 풀에서 연결을 빌려 사용하므로 동시 요청이 하나의 연결에 직렬화되지 않음
+    if retrieval_use_filters:
+        # 학교급/학년으로 먼저 좁힌 뒤 벡터 검색
+        retrieved_data = await asyncio.to_thread(
+            search_metadata_filtered,
+            vector=embed_metadata,
+            requirements=requirements,
+            k=k,
+            exclude=rejected,
+        )
+    else:
+        retrieved_data = await asyncio.to_thread(
+            search_metadata,
+            vector=embed_metadata,
+            k=k,
+            exclude=rejected,
+        )
+    logger.info("벡터 검색 완료", extra={
+        "attempt": attempt,
+        "k": k,
+        "excluded": len(rejected),
+        "basecodes": [res.get("basecode") for res in retrieved_data],
+    })
     
     return {
         "retrieved_docs": retrieved_data,
-        "metadata":concated_metadata
+        "metadata":concated_metadata,
+        "retrieval_attempt": attempt,
+    }
+
+def lookup_basecode_node(state: MainState) -> dict:
+    """
+    요구사항이나 프롬프트에 성취기준 코드(basecode)가 있으면
+    임베딩, 벡터 검색, 관련성 평가 없이 해당 코드의 교육과정 행을 바로 사용하는 노드
+    """
+    requirements = state["requirements"]
+    retrieved_data = find_basecode_rows(requirements, state.get("prompt"))
+    logger.info("basecode 직접 조회 완료", extra={"basecodes": [res.get("basecode") for res in retrieved_data]})
+
+    return {
+        "retrieved_docs": retrieved_data,
+        "metadata": f"{requirements.school_level} {requirements.grade} {requirements.subject} {requirements.domain}",
+        "binary_score": "yes",
     }
 
 def consolidate_response_node(state: MainState) -> dict:
     """
     병렬로 생성된 콘텐츠들을 종합하여 최종 답변을 만듭니다.
     """
-    print("\n--- 최종 답변 종합 노드 실행 ---")
     requirements = state["requirements"]
-    problems = state['problem_state']['problems']
-    learning_goals = state['goal_state']['learning_goals']
+    # 한 종류만 요청한 경우 다른 쪽 상태는 비어 있음
+    problems = (state.get('problem_state') or {}).get('problems')
+    learning_goals = (state.get('goal_state') or {}).get('learning_goals')
     
 
     final_response_parts = []
@@ -107,25 +216,26 @@ def consolidate_response_node(state: MainState) -> dict:
         final_response_parts.append("\n### 연습 문제\n" + problems.content)
         
     final_response = "\n".join(final_response_parts)
-    print("-> 최종 답변 생성 완료")
+    logger.info("최종 답변 생성 완료", extra={"response_chars": len(final_response)})
     
     return {"final_response": final_response}
 
-def generate_learning_goals_node(state: MainState) -> dict:
+async def generate_learning_goals_node(state: MainState) -> dict:
     """
     입력된 정보를 바탕으로 학습 목표를 생성합니다. (병렬 처리 대상)
     """
     requirements = state["requirements"]
-    docs = state["retrieved_docs"]
+    docs = format_docs(state["retrieved_docs"])
     try:
         prompt_template = ChatPromptTemplate.from_template(
             "{school_level} {grade} {subject} 과목의 '{domain}' 단원에 대한 학습 목표를 생성해줘.\n"
             "참고 자료:\n{docs}"
         )
     
-        chain = prompt_template | llm
+        chain = prompt_template | get_llm()
 
-        learning_goals = chain.invoke({
+        GENERATION_CALLS.inc(mode="split")
+        learning_goals = await chain.ainvoke({
             "school_level": requirements.school_level,
             "grade": requirements.grade,
             "subject": requirements.subject,
@@ -138,6 +248,7 @@ def generate_learning_goals_node(state: MainState) -> dict:
                 "status": "success"},
         }
     except Exception as e:
+        logger.exception("학습 목표 생성 실패")
         return {
             "goal_state" : {
                 "error_message" : e,
@@ -148,20 +259,21 @@ def generate_learning_goals_node(state: MainState) -> dict:
 
     
 
-def generate_problems_node(state: MainState) -> dict:
+async def generate_problems_node(state: MainState) -> dict:
     """
     검색된 정보를 바탕으로 연습 문제를 생성합니다. (병렬 처리 대상)
     """
     requirements = state["requirements"]
-    docs = state["retrieved_docs"]
+    docs = format_docs(state["retrieved_docs"])
     try:
         prompt_template = ChatPromptTemplate.from_template(
             "{school_level} {grade} {subject} 과목의 '{domain}' 단원에 대한 이해를 확인할 수 있는 문제를 상,중,하 수준의 문제들을 각각 1개씩 생성해줘.\n"
             "참고 자료:\n{docs}"
         )
         
-        chain = prompt_template | llm
-        problems = chain.invoke({
+        chain = prompt_template | get_llm()
+        GENERATION_CALLS.inc(mode="split")
+        problems = await chain.ainvoke({
             "school_level": requirements.school_level,
             "grade": requirements.grade,
             "subject": requirements.subject,
@@ -175,6 +287,7 @@ def generate_problems_node(state: MainState) -> dict:
                 "status": "success"},
         }
     except Exception as e:
+        logger.exception("연습 문제 생성 실패")
         return {
             "problem_state" : {
                 "error_message" : e,
@@ -184,51 +297,116 @@ def generate_problems_node(state: MainState) -> dict:
         
 
 
+async def generate_combined_node(state: MainState) -> dict:
+    """
+    학습 목표와 연습 문제를 모두 요청한 경우, 같은 참고 자료로 두 콘텐츠를
+    한 번의 구조화된 출력 호출로 함께 생성합니다.
+    consolidate_response 노드가 그대로 사용할 수 있도록 각 결과를 메시지로 감싸 두 상태를 모두 채웁니다.
+    """
+    requirements = state["requirements"]
+    docs = format_docs(state["retrieved_docs"])
+    try:
+        prompt_template = ChatPromptTemplate.from_template(
+            "{school_level} {grade} {subject} 과목의 '{domain}' 단원에 대해 다음 두 가지를 생성해줘.\n"
+            "1. learning_goals: 단원의 학습 목표\n"
+            "2. problems: 단원에 대한 이해를 확인할 수 있는 상,중,하 수준의 문제 각각 1개\n"
+            "참고 자료:\n{docs}"
+        )
+
+        chain = prompt_template | get_llm().with_structured_output(GeneratedContent)
+        GENERATION_CALLS.inc(mode="combined")
+        generated = await chain.ainvoke({
+            "school_level": requirements.school_level,
+            "grade": requirements.grade,
+            "subject": requirements.subject,
+            "domain": requirements.domain,
+            "docs": docs
+        })
+        return {
+            "goal_state": {
+                "learning_goals": AIMessage(content=generated.learning_goals),
+                "status": "success"},
+            "problem_state": {
+                "problems": AIMessage(content=generated.problems),
+                "status": "success"},
+        }
+    except Exception as e:
+        logger.exception("학습 목표/연습 문제 통합 생성 실패")
+        return {
+            "goal_state": {
+                "error_message": e,
+                "status": "failure"
+            },
+            "problem_state": {
+                "error_message": e,
+                "status": "failure"
+            },
+        }
+
+
 # 검색된 문서의 관련성 평가
-def grade_documents(state:MainState):
+async def grade_documents(state:MainState):
     """
     Vector DB로부터 검색한 수업 대상의 메타데이터와 
     요구사항으로부터 추출한 메타데이터가 연관성이 있는지 검사합니다
     """
-    print("==== [GRADE DOCUMENTS] ====")
-    
-
-    retrieval_grader = get_grader(llm)
+    retrieval_grader = get_grader(get_llm())
 
     question = state["metadata"]
     documents = state["retrieved_docs"]
 
-    # 각 문서 점수 평가
-    filtered_docs = []
-    for d in documents:
-        joined_doc = " ".join(val for val in d.values())
-        score = retrieval_grader.invoke(
-            {"question": question, "document": joined_doc}
-        )
-        grade = score.binary_score
-        if grade == "yes":
-            print("==== GRADE: DOCUMENT RELEVANT ====")
-            filtered_docs.append(d)
-        else:
-            print("==== GRADE: DOCUMENT NOT RELEVANT ====")
-            continue
     # 검색된 문서의 갯수중에 70% 이상 연관 있을 때 통과
-    threshold = int(round(len(documents) * 0.7))
-    if len(filtered_docs) >= threshold:
+    # 재검색으로 k가 늘어나도 통과 기준은 첫 검색(retrieval_k개) 기준을 넘지 않도록 제한
+    threshold = int(round(min(len(documents), retrieval_k) * grade_pass_ratio))
+
+    # 각 문서 점수를 동시에 평가하고, 통과 여부가 확정되면 남은 평가는 생략
+    # 이전 요청이나 재검색 루프에서 평가한 (메타데이터, basecode) 쌍은 캐시된 결과를 사용
+    filtered_docs, rejected_docs, graded = await grade_documents_concurrently(
+        retrieval_grader,
+        question,
+        documents,
+        threshold,
+        verdict_cache=grade_verdict_cache,
+    )
+    GRADER_CALLS.observe(graded)
+    GRADER_CACHED_VERDICTS.inc(len(filtered_docs) + len(rejected_docs) - graded)
+    logger.info("관련성 평가 완료", extra={
+        "documents": len(documents),
+        "graded": graded,
+        "relevant": len(filtered_docs),
+        "threshold": threshold,
+    })
+
+    if documents and len(filtered_docs) >= threshold:
         return {"binary_score": "yes"}
-    else:
-        return {"binary_score": "no"}
+
+    # 관련 없다고 평가된 문서는 다음 검색에서 제외
+    rejected_basecodes = list(state.get("rejected_basecodes") or [])
+    for doc in rejected_docs:
+        basecode = doc.get("basecode")
+        if basecode and basecode not in rejected_basecodes:
+            rejected_basecodes.append(basecode)
+    return {
+        "binary_score": "no",
+        "rejected_basecodes": rejected_basecodes,
+    }
 
 def error_handler(state: MainState) -> MainState:
     # 오류를 남기거나 사용자에게 알리거나 후속조치를 위함
     # 각 서브 상태에서 에러 메시지를 가져옴
-    problem_error = state.get('problem_state', {}).get('error_message')
-    goal_error = state.get('goal_state', {}).get('error_message')
+    problem_error = (state.get('problem_state') or {}).get('error_message')
+    goal_error = (state.get('goal_state') or {}).get('error_message')
     
     final_error_message = "오류가 발생했습니다.\n"
+    if state.get('binary_score') == "no":
+        final_error_message += (
+            f"검색 오류: {state.get('retrieval_attempt', 0)}회 검색했지만 "
+            "요청과 관련된 교육과정 문서를 찾지 못했습니다.\n"
+        )
     if problem_error:
         final_error_message += f"문제 생성 오류: {problem_error}\n"
     if goal_error:
         final_error_message += f"학습 목표 생성 오류: {goal_error}\n"
+    logger.warning("오류 처리 노드 실행", extra={"error": final_error_message})
         
     return {"final_response": final_error_message}
\ No newline at end of file
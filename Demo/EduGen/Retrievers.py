@@ -0,0 +1,390 @@
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+from Utils import get_db_pool
+from Utils import load_embedding_artifact
+from Settings import retrieval_backend
+from Settings import embedded_data_path
+from Settings import vector_index_refresh_interval
+from Settings import hnsw_ef_search
+from Settings import hnsw_iterative_scan
+from Metrics import DB_QUERY_DURATION_SECONDS
+
+try:
+    import faiss
+except ImportError:  # faiss-cpu가 없으면 NumPy 행렬 곱으로 검색
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+# 검색 결과로 반환할 컬럼 (pgvector 백엔드의 SELECT 컬럼과 동일한 순서)
+RESULT_COLUMNS = ["basecode", "content", "school_level", "grade", "domain", "category"]
+# 검색 전 필터로 사용할 수 있는 메타데이터 컬럼
+FILTER_COLUMNS = ("school_level", "grade", "domain", "category")
+
+
+def _validate_filters(filters):
+    unknown = set(filters or {}) - set(FILTER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unsupported filter columns: {sorted(unknown)}")
+
+
+class PgVectorBackend:
+    """
+    Searches the curriculum table in Postgres with pgvector's cosine distance.
+    """
+    def __init__(
+        self,
+        table_name="curriculum",
+        ):
+        self.table_name = table_name
+
+    @staticmethod
+    def _where_clause(
+        filters=None,
+        exclude=None,
+        keyword=None,
+        ):
+        """Builds the WHERE clause and its parameters for filters, excluded basecodes and a keyword."""
+        _validate_filters(filters)
+        conditions = [f"{col} = %s" for col in (filters or {})]
+        params = list((filters or {}).values())
+        if exclude:
+            conditions.append("basecode <> ALL(%s)")
+            params.append(list(exclude))
+        if keyword:
+            conditions.append("(domain ILIKE %s OR category ILIKE %s OR content ILIKE %s)")
+            params.extend([f"%{keyword}%"] * 3)
+        where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return where_sql, params
+
+    def _search(
+        self,
+        conn,
+        vector,
+        k,
+        filters=None,
+        exclude=None,
+        ):
+        where_sql, params = self._where_clause(filters, exclude)
+
+        with DB_QUERY_DURATION_SECONDS.time(backend="pgvector", operation="search"):
+            with conn.cursor() as cursor:
+                if hnsw_ef_search:
+                    cursor.execute("SET LOCAL hnsw.ef_search = %s", (hnsw_ef_search,))
+                if filters and hnsw_iterative_scan:
+                    # pgvector 0.8+: 필터로 후보가 줄어도 k개를 채울 때까지 HNSW 탐색을 계속
+                    cursor.execute("SET LOCAL hnsw.iterative_scan = %s", (hnsw_iterative_scan,))
+                # 벡터 검색 시 필요한 모든 컬럼을 가져옵니다.
+                cursor.execute(
+                    f"""SELECT {', '.join(RESULT_COLUMNS)}
+                        FROM {self.table_name}
+                        {where_sql}
+                        ORDER BY embedding <=> %s::vector LIMIT %s""",
+                    (*params, list(vector), k)
+                )
+                # 결과를 딕셔너리 리스트로 변환
+                results = [
+                    dict(zip([desc[0] for desc in cursor.description], row))
+                    for row in cursor.fetchall()
+                ]
+                return results
+
+    def search(
+        self,
+        vector,
+        k=3,
+        conn=None,
+        filters=None,
+        exclude=None,
+        ):
+        """
+        Returns the k nearest curriculum rows as a list of dicts.
+
+        Args:
+            vector (array-like): The query embedding.
+            k (int): The number of rows to return.
+            conn (optional): An open psycopg2 connection. When omitted a
+                             connection is borrowed from the process-wide pool.
+            filters (dict, optional): Exact-match metadata filters (e.g.
+                                      {"school_level": "고등", "grade": "10"})
+                                      applied before the ANN ordering.
+            exclude (list[str], optional): Basecodes to leave out of the results.
+        """
+        if conn is not None:
+            return self._search(conn, vector, k, filters, exclude)
+        return get_db_pool().run(lambda conn: self._search(conn, vector, k, filters, exclude))
+
+    def _lookup(
+        self,
+        conn,
+        filters,
+        keyword,
+        k,
+        exclude,
+        ):
+        where_sql, params = self._where_clause(filters, exclude, keyword)
+        with DB_QUERY_DURATION_SECONDS.time(backend="pgvector", operation="lookup"), conn.cursor() as cursor:
+            cursor.execute(
+                f"""SELECT {', '.join(RESULT_COLUMNS)}
+                    FROM {self.table_name}
+                    {where_sql}
+                    ORDER BY basecode LIMIT %s""",
+                (*params, k)
+            )
+            return [
+                dict(zip([desc[0] for desc in cursor.description], row))
+                for row in cursor.fetchall()
+            ]
+
+    def lookup(
+        self,
+        filters=None,
+        keyword=None,
+        k=3,
+        exclude=None,
+        conn=None,
+        ):
+        """
+        Returns up to k rows matching the metadata filters and a domain/category/content
+        keyword, without vector search.
+        """
+        if conn is not None:
+            return self._lookup(conn, filters, keyword, k, exclude)
+        return get_db_pool().run(lambda conn: self._lookup(conn, filters, keyword, k, exclude))
+
+    def _fetch_all(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(RESULT_COLUMNS)} FROM {self.table_name}")
+            return [
+                dict(zip([desc[0] for desc in cursor.description], row))
+                for row in cursor.fetchall()
+            ]
+
+    def fetch_all(self, conn=None):
+        """Returns every curriculum row (without embeddings) as a list of dicts."""
+        if conn is not None:
+            return self._fetch_all(conn)
+        return get_db_pool().run(self._fetch_all)
+
+
+class InMemoryVectorBackend:
+    """
+    Serves nearest-neighbour search from an in-process index built from the
+    JsonEmbedder output, so read-heavy deployments need no DB round trip.
+
+    A `.npy` artifact is memory-mapped and searched with NumPy without parsing or
+    copying the vectors; a JSON output is parsed into a normalized matrix that
+    is searched with FAISS when it is installed.
+
+    The index is rebuilt in a background thread when the source file changes;
+    searches keep using the previous snapshot until the new one is swapped in.
+    """
+    def __init__(
+        self,
+        source_path=embedded_data_path,
+        refresh_interval=vector_index_refresh_interval,
+        use_faiss=True,
+        ):
+        """
+        Args:
+            source_path (str): Path to the embedded curriculum file (JSON or `.npy` artifact)
+                               written by JsonEmbedder.
+            refresh_interval (float): Seconds between source change checks. 0 disables refresh.
+            use_faiss (bool): Use a FAISS flat inner-product index when faiss is installed.
+        """
+        self.source_path = source_path
+        self.refresh_interval = refresh_interval
+        self.use_faiss = use_faiss and faiss is not None
+        self._snapshot = None
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self.reload()
+
+    def _build_snapshot(self):
+        index = None
+        inv_norms = None
+        if self.source_path.endswith(".npy"):
+            # 벡터는 메모리 매핑으로 열고, 코사인 유사도를 위한 행별 노름의 역수만 계산
+            df, matrix = load_embedding_artifact(self.source_path, mmap=True)
+            norms = np.linalg.norm(matrix, axis=1).astype(np.float32)
+            inv_norms = 1.0 / np.where(norms == 0, 1, norms)
+        else:
+            df = pd.read_json(self.source_path)
+            matrix = np.asarray(df["embedding"].tolist(), dtype=np.float32)
+            # 코사인 거리(pgvector의 <=>)와 같은 순서가 되도록 정규화 후 내적으로 검색
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+            if self.use_faiss:
+                index = faiss.IndexFlatIP(matrix.shape[1])
+                index.add(matrix)
+
+        # pgvector의 TEXT 컬럼과 같은 형태가 되도록 문자열로 변환
+        rows = [
+            {col: str(record[col]) for col in RESULT_COLUMNS}
+            for record in df[RESULT_COLUMNS].to_dict(orient="records")
+        ]
+
+        # 메타데이터 필터용 컬럼 값 배열
+        columns = {
+            col: np.array([row[col] for row in rows], dtype=object)
+            for col in FILTER_COLUMNS
+        }
+
+        return {
+            "matrix": matrix,
+            "inv_norms": inv_norms,
+            "basecodes": np.array([row["basecode"] for row in rows], dtype=object),
+            "rows": rows,
+            "columns": columns,
+            "index": index,
+        }
+
+    def reload(self):
+        """Rebuilds the index from the source file and swaps it in atomically."""
+        mtime = os.path.getmtime(self.source_path)
+        snapshot = self._build_snapshot()
+        snapshot["mtime"] = mtime
+        self._snapshot = snapshot
+        logger.info("In-memory vector index loaded", extra={"rows": len(snapshot["rows"]), "source_path": self.source_path})
+
+    def _watch_source(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                if os.path.getmtime(self.source_path) != self._snapshot["mtime"]:
+                    self.reload()
+            except Exception as e:
+                # 갱신에 실패해도 기존 인덱스로 계속 서비스
+                logger.warning("Failed to refresh in-memory vector index", extra={"error": str(e), "source_path": self.source_path})
+
+    def start_auto_refresh(self):
+        """Starts a daemon thread that reloads the index when the source file changes."""
+        if self.refresh_interval <= 0 or self._refresh_thread is not None:
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._watch_source, daemon=True)
+        self._refresh_thread.start()
+
+    def stop_auto_refresh(self):
+        self._stop_event.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+            self._refresh_thread = None
+
+    def search(
+        self,
+        vector,
+        k=3,
+        conn=None,
+        filters=None,
+        exclude=None,
+        ):
+        """Returns the k nearest curriculum rows in the same shape as PgVectorBackend."""
+        with DB_QUERY_DURATION_SECONDS.time(backend="memory", operation="search"):
+            snapshot = self._snapshot
+            rows = snapshot["rows"]
+
+            query = np.asarray(vector, dtype=np.float32).reshape(-1)
+            norm = np.linalg.norm(query)
+            if norm:
+                query = query / norm
+
+            if filters or exclude:
+                # 필터에 맞는 행만 후보로 남긴 뒤 정확한 내적 검색
+                candidates = np.flatnonzero(self._mask(snapshot, filters, exclude))
+                return [dict(rows[i]) for i in self._top_k(self._scores(snapshot, query, candidates), k, candidates)]
+
+            if snapshot["index"] is not None:
+                k = min(k, len(rows))
+                if k == 0:
+                    return []
+                _, ids = snapshot["index"].search(query[None, :], k)
+                return [dict(rows[i]) for i in ids[0]]
+            return [dict(rows[i]) for i in self._top_k(self._scores(snapshot, query), k)]
+
+    @staticmethod
+    def _mask(
+        snapshot,
+        filters=None,
+        exclude=None,
+        ):
+        """Returns a boolean mask of rows matching the filters and not in `exclude`."""
+        _validate_filters(filters)
+        mask = np.ones(len(snapshot["rows"]), dtype=bool)
+        for col, value in (filters or {}).items():
+            mask &= snapshot["columns"][col] == str(value)
+        if exclude:
+            mask &= ~np.isin(snapshot["basecodes"], list(exclude))
+        return mask
+
+    def lookup(
+        self,
+        filters=None,
+        keyword=None,
+        k=3,
+        exclude=None,
+        conn=None,
+        ):
+        """Returns up to k rows matching the filters and keyword, like PgVectorBackend.lookup."""
+        snapshot = self._snapshot
+        rows = snapshot["rows"]
+        ids = np.flatnonzero(self._mask(snapshot, filters, exclude))
+        if keyword:
+            ids = [
+                i for i in ids
+                if any(keyword in rows[i][col] for col in ("domain", "category", "content"))
+            ]
+        ids = sorted(ids, key=lambda i: rows[i]["basecode"])[:k]
+        return [dict(rows[i]) for i in ids]
+
+    @staticmethod
+    def _scores(
+        snapshot,
+        query,
+        ids=None,
+        ):
+        """Returns cosine similarities between the (normalized) query and the rows in `ids`."""
+        matrix = snapshot["matrix"] if ids is None else snapshot["matrix"][ids]
+        scores = matrix @ query
+        if snapshot["inv_norms"] is not None:
+            scores = scores * (snapshot["inv_norms"] if ids is None else snapshot["inv_norms"][ids])
+        return scores
+
+    @staticmethod
+    def _top_k(
+        scores,
+        k,
+        ids=None,
+        ):
+        """Returns the ids of the k highest scores in descending score order."""
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top if ids is None else ids[top]
+
+
+RETRIEVAL_BACKENDS = {
+    "pgvector": PgVectorBackend,
+    "memory": InMemoryVectorBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_retrieval_backend():
+    """Returns the process-wide retrieval backend selected by RETRIEVAL_BACKEND."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if retrieval_backend not in RETRIEVAL_BACKENDS:
+                raise ValueError(
+                    f"Unknown retrieval backend '{retrieval_backend}'. "
+                    f"Choose one of {list(RETRIEVAL_BACKENDS)}."
+                )
+            _backend = RETRIEVAL_BACKENDS[retrieval_backend]()
+        return _backend
@@ -7,6 +7,73 @@ DB_PARAMS = {
     'user': os.environ.get("POSTGRES_USER",'postgres'),     # 데이터베이스 사용자 이름
     'password': os.environ.get("POSTGRES_PWD",'test1234'),  # 데이터베이스 비밀번호
 }
+# Postgres 커넥션 풀 설정 (타임아웃/헬스체크 주기 단위: 초)
+db_pool_min_size = int(os.environ.get("DB_POOL_MIN_SIZE", 1))
+db_pool_max_size = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+db_pool_timeout = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+db_health_check_interval = float(os.environ.get("DB_HEALTH_CHECK_INTERVAL", 30))
 embedding_model_name = "BAAI/bge-m3"
+# 검색 백엔드 설정: pgvector(기본) 또는 memory(JsonEmbedder 결과로 만든 프로세스 내 인덱스)
+retrieval_backend = os.environ.get("RETRIEVAL_BACKEND", "pgvector")
+# 임베딩 결과 저장 형식: json(레코드 JSON) 또는 npy(메모리 매핑 가능한 .npy + .meta.jsonl)
+embedding_output_format = os.environ.get("EMBEDDING_OUTPUT_FORMAT", "json")
+embedding_dtype = os.environ.get("EMBEDDING_DTYPE", "float32")
+embedded_data_path = os.environ.get(
+    "EMBEDDED_DATA_PATH",
+    pwd + "/all_basecode_embeddings_" + embedding_model_name.split("/")[-1]
+    + (".npy" if embedding_output_format == "npy" else ".json"),
+)
+vector_index_refresh_interval = float(os.environ.get("VECTOR_INDEX_REFRESH_INTERVAL", 30))
+# 요구사항의 학교급/학년으로 검색 대상을 먼저 좁힐지 여부와 pgvector HNSW 검색 파라미터
+retrieval_use_filters = os.environ.get("RETRIEVAL_USE_FILTERS", "true").lower() == "true"
+hnsw_ef_search = int(os.environ.get("HNSW_EF_SEARCH", 0)) or None
+hnsw_iterative_scan = os.environ.get("HNSW_ITERATIVE_SCAN", "strict_order") or None
+# 재검색 전략: 기본 검색 개수, 재검색 시 k 확장 배수, 최대 검색 시도 횟수
+retrieval_k = int(os.environ.get("RETRIEVAL_K", 3))
+retrieval_widen_factor = int(os.environ.get("RETRIEVAL_WIDEN_FACTOR", 2))
+max_retrieval_attempts = int(os.environ.get("MAX_RETRIEVAL_ATTEMPTS", 3))
+# 교육과정 원본 데이터 경로와 규칙 기반 요구사항 추출(확실한 경우 LLM 호출 생략) 사용 여부
+curriculum_data_path = os.environ.get("CURRICULUM_DATA_PATH", pwd + "/all_basecode.json")
+rule_based_extraction = os.environ.get("RULE_BASED_EXTRACTION", "true").lower() == "true"
+# basecode 직접 조회 인덱스 설정: 원본(json 또는 db 테이블), 접두어 조회 시 허용할 최대 행 수
+basecode_index_source = os.environ.get("BASECODE_INDEX_SOURCE", "json")
+basecode_prefix_max_rows = int(os.environ.get("BASECODE_PREFIX_MAX_ROWS", 30))
 project_name =  os.environ.get("PROJECT_NAME",'Test_Demo_App')
-env_path = "/".join(pwd.split("/")[:-2]) + "/.env"
\ No newline at end of file
+env_path = "/".join(pwd.split("/")[:-2]) + "/.env"
+
+# 쿼리 임베딩 캐시 설정 (TTL 단위: 초)
+query_embedding_cache_size = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1024))
+query_embedding_cache_ttl = float(os.environ.get("QUERY_EMBEDDING_CACHE_TTL", 3600))
+
+# 문서 관련성 평가 설정: 동시에 실행할 최대 평가 호출 수, 통과 기준 비율
+grader_max_concurrency = int(os.environ.get("GRADER_MAX_CONCURRENCY", 4))
+grade_pass_ratio = float(os.environ.get("GRADE_PASS_RATIO", 0.7))
+# (메타데이터, basecode)별 평가 결과 캐시 설정 (TTL 단위: 초)
+grade_verdict_cache_size = int(os.environ.get("GRADE_VERDICT_CACHE_SIZE", 4096))
+grade_verdict_cache_ttl = float(os.environ.get("GRADE_VERDICT_CACHE_TTL", 24 * 3600))
+
+# LLM 응답 캐시 설정 (기본 비활성화, TTL 단위: 초, 0이면 만료 없음)
+llm_cache_enabled = os.environ.get("LLM_CACHE_ENABLED", "false").lower() == "true"
+llm_cache_path = os.environ.get("LLM_CACHE_PATH", pwd + "/.cache/llm_cache.sqlite")
+llm_cache_max_entries = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+llm_cache_ttl = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)) or None
+
+# 로그 레벨 (구조화된 JSON 로그)
+log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# 배치 생성 설정: 동시에 처리할 최대 프롬프트 수, 요청당 최대 프롬프트 수
+batch_max_concurrency = int(os.environ.get("BATCH_MAX_CONCURRENCY", 4))
+batch_max_prompts = int(os.environ.get("BATCH_MAX_PROMPTS", 100))
+
+# 학습 목표와 연습 문제를 모두 요청하면 한 번의 구조화된 출력 호출로 함께 생성
+# (요청별로 config의 configurable.combined_generation으로 덮어쓸 수 있음)
+combined_generation = os.environ.get("COMBINED_GENERATION", "true").lower() == "true"
+
+# 생성 프롬프트에 넣을 참고 자료의 최대 토큰 수 (추정치, 0이면 제한 없음)
+context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1500))
+
+# 서버 시작 시 워밍업 설정: 실패한 단계의 재시도 간격(초, 실패할 때마다 최대값까지 두 배),
+# 워밍업에서 실제 LLM 호출(요금/쿼터 사용) 여부
+warmup_retry_interval = float(os.environ.get("WARMUP_RETRY_INTERVAL", 2))
+warmup_retry_max_interval = float(os.environ.get("WARMUP_RETRY_MAX_INTERVAL", 60))
+warmup_llm_call = os.environ.get("WARMUP_LLM_CALL", "false").lower() == "true"
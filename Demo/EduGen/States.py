@@ -20,6 +20,12 @@ class GradeDocuments(BaseModel):
     binary_score: str = Field(
         description="Documents are relevant to the question, 'yes' or 'no'"
     )
+# 학습 목표와 연습 문제를 한 번의 LLM 호출로 생성할 때의 구조화된 출력 모델
+class GeneratedContent(BaseModel):
+    """하나의 참고 자료로 함께 생성한 학습 목표와 연습 문제"""
+    learning_goals: str = Field(description="단원의 학습 목표 (마크다운)")
+    problems: str = Field(description="상, 중, 하 수준별 연습 문제 각 1개 (마크다운)")
+
 class ProblemState(TypedDict):
     problems: Optional[str]               # 노드의 결과 (생성된 문제)
     status: str                           # 노드 실행 상태 (success/failure)
@@ -36,6 +42,8 @@ class MainState(TypedDict):
     requirements: Optional[Requirements]  # 노드 1의 결과 (추출된 요구사항)
     retrieved_docs: Optional[List[dict]]  # 노드 2의 결과 (벡터 DB 검색 결과)
     binary_score: str                    # 관련성 검증 노드의 결과 값
+    retrieval_attempt: int               # 검색 노드 실행 횟수 (재검색 전략 선택에 사용)
+    rejected_basecodes: List[str]        # 관련성 평가에서 탈락한 문서의 basecode (재검색 시 제외)
     final_response: Optional[str]        # 최종 답변
 
     # 병렬 노드들의 상태를 여기에 포함 (개별 객체로 관리)
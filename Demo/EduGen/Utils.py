@@ -1,17 +1,68 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 import psycopg2
+from psycopg2 import extensions as pg_extensions
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
 from Settings import DB_PARAMS
+from Settings import db_pool_min_size
+from Settings import db_pool_max_size
+from Settings import db_pool_timeout
+from Settings import db_health_check_interval
 from Settings import env_path
+from Settings import llm_cache_enabled
+from Settings import llm_cache_path
+from Settings import llm_cache_max_entries
+from Settings import llm_cache_ttl
+from Caches import SQLiteLLMCache
+from Metrics import DB_POOL_WAIT_SECONDS
+from Metrics import token_usage_handler
 import os
 from dotenv import load_dotenv
 import pandas as pd
 from google.genai import Client
 from tqdm import tqdm
 from google.genai import types
-from sentence_transformers import SentenceTransformer
+import logging
+import resource
+import threading
+import time
+import hashlib
+import json
+import asyncio
+import random
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 
 load_dotenv(env_path)
-def init_llm():
+
+logger = logging.getLogger(__name__)
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """Returns the process-wide SQLite LLM cache."""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = SQLiteLLMCache(
+                llm_cache_path,
+                max_entries=llm_cache_max_entries,
+                ttl=llm_cache_ttl,
+            )
+        return _llm_cache
+
+
+def init_llm(use_cache=None):
+    """
+    use_cache가 True이면(기본값은 LLM_CACHE_ENABLED 설정) 동일한 모델/프롬프트/출력 스키마/파라미터 호출을
+    로컬 SQLite 캐시에서 바로 반환합니다.
+    """
+    if use_cache is None:
+        use_cache = llm_cache_enabled
     # define llm
     llm = ChatGoogleGenerativeAI(
         model="gemini-2.5-flash",
@@ -19,6 +70,9 @@ def init_llm():
         max_tokens=None,
         timeout=None,
         max_retries=2,
+        cache=get_llm_cache() if use_cache else None,
+        # 호출별 입력/출력 토큰 수를 /metrics로 집계
+        callbacks=[token_usage_handler],
         # other params...
     )
     return llm
@@ -28,6 +82,484 @@ def postgres_conn():
     return conn
 
 
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available within the timeout."""
+
+
+class PostgresConnectionPool:
+    """
+    A blocking, health-checked pool of psycopg2 connections.
+
+    Connections are validated before being handed out when they have been idle
+    longer than `health_check_interval`, and broken connections are discarded
+    and replaced, so a Postgres restart is recovered from transparently.
+    """
+    def __init__(
+        self,
+        min_size=db_pool_min_size,
+        max_size=db_pool_max_size,
+        timeout=db_pool_timeout,
+        health_check_interval=db_health_check_interval,
+        db_params=DB_PARAMS,
+        ):
+        """
+        Args:
+            min_size (int): The number of connections kept open.
+            max_size (int): The maximum number of concurrently borrowed connections.
+            timeout (float): Seconds to wait for a free connection before failing.
+            health_check_interval (float): Idle seconds after which a connection
+                                           is pinged before reuse.
+            db_params (dict): Keyword arguments passed to psycopg2.connect.
+        """
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.db_params = db_params
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._last_used = {}
+
+        # metrics
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.borrows = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _get_pool(self):
+        # DB가 잠시 내려가 있어도 import/생성 시점에 실패하지 않도록 최초 사용 시 풀을 생성
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(self.min_size, self.max_size, **self.db_params)
+            return self._pool
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn), 0.0)
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _acquire(self):
+        pool = self._get_pool()
+        # 유휴 연결이 모두 끊어졌을 수 있으므로 살아있는 연결을 얻을 때까지 교체
+        for _ in range(self.max_size):
+            conn = pool.getconn()
+            if self._is_alive(conn):
+                return conn
+            pool.putconn(conn, close=True)
+            self._last_used.pop(id(conn), None)
+            with self._lock:
+                self.reconnects += 1
+        return pool.getconn()
+
+    def _release(self, conn, broken=False):
+        pool = self._get_pool()
+        if not broken and not conn.closed:
+            # 트랜잭션이 열린 채로 반환되지 않도록 정리
+            if conn.get_transaction_status() != pg_extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn)
+        else:
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+
+    @contextmanager
+    def connection(self):
+        """Borrows a healthy connection for the duration of the `with` block."""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeoutError(f"No database connection available within {self.timeout}s")
+        waited = time.perf_counter() - start
+        DB_POOL_WAIT_SECONDS.observe(waited)
+
+        with self._lock:
+            self.borrows += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+        conn = None
+        broken = False
+        try:
+            conn = self._acquire()
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._release(conn, broken=broken)
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def run(
+        self,
+        fn,
+        retries=1,
+        ):
+        """
+        Calls `fn(conn)` with a pooled connection, retrying on a fresh connection
+        when the borrowed one turns out to be broken.
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as conn:
+                    return fn(conn)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == retries:
+                    raise
+                logger.warning("Database connection lost, reconnecting", extra={"error": str(e), "attempt": attempt + 1})
+                with self._lock:
+                    self.reconnects += 1
+
+    def stats(self):
+        """Returns wait-time and saturation metrics for the pool."""
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "saturation": round(self.in_use / self.max_size, 4),
+                "borrows": self.borrows,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+                "avg_wait_ms": round(self.total_wait_seconds / self.borrows * 1000, 3) if self.borrows else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            }
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Returns the process-wide Postgres connection pool."""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = PostgresConnectionPool()
+        return _db_pool
+
+
+def _current_rss_bytes():
+    """Returns the resident set size of the current process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # /proc가 없는 환경(macOS 등)에서는 최대 RSS로 대체 (macOS는 byte, Linux는 KB 단위)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == "Darwin" else max_rss * 1024
+
+
+class EmbeddingModelRegistry:
+    """
+    A process-wide registry that loads each SentenceTransformer model exactly once
+    and shares it across threads.
+    """
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._model_locks = {}
+
+    def _get_model_lock(self, model_name):
+        with self._lock:
+            return self._model_locks.setdefault(model_name, threading.Lock())
+
+    def get(self, model_name):
+        """
+        Returns the shared model instance, loading it on first use.
+
+        Args:
+            model_name (str): The name of the SentenceTransformer model.
+
+        Returns:
+            SentenceTransformer: The loaded model.
+        """
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+
+        # 모델별 잠금을 사용하여 서로 다른 모델은 동시에 로드할 수 있도록 함
+        with self._get_model_lock(model_name):
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._load(model_name)
+        return model
+
+    def _load(self, model_name):
+        # sentence_transformers(torch) import는 수 초가 걸리므로 모델을 처음 로드할 때 import
+        from sentence_transformers import SentenceTransformer
+        rss_before = _current_rss_bytes()
+        start = time.perf_counter()
+        model = SentenceTransformer(model_name)
+        load_seconds = time.perf_counter() - start
+        rss_after = _current_rss_bytes()
+
+        with self._lock:
+            self._models[model_name] = model
+            self._stats[model_name] = {
+                "load_seconds": round(load_seconds, 3),
+                "rss_delta_mb": round((rss_after - rss_before) / 1024 ** 2, 1),
+                "rss_after_mb": round(rss_after / 1024 ** 2, 1),
+            }
+        logger.info("Loaded embedding model", extra={"model": model_name, **self._stats[model_name]})
+        return model
+
+    def register(self, model_name, model):
+        """Registers an already constructed model (e.g. a local stub) under `model_name`."""
+        with self._lock:
+            self._models[model_name] = model
+            self._stats[model_name] = {
+                "load_seconds": 0.0,
+                "rss_delta_mb": 0.0,
+                "rss_after_mb": round(_current_rss_bytes() / 1024 ** 2, 1),
+            }
+
+    def warmup(self, model_names):
+        """Loads the given models ahead of the first request."""
+        for model_name in model_names:
+            self.get(model_name).encode("warmup")
+
+    def stats(self):
+        """Returns load time and resident memory for each loaded model."""
+        with self._lock:
+            return {name: dict(stat) for name, stat in self._stats.items()}
+
+
+embedding_registry = EmbeddingModelRegistry()
+
+
+def get_embedding_model(model_name):
+    """Returns the shared SentenceTransformer instance from the process-wide registry."""
+    return embedding_registry.get(model_name)
+
+
+
+def artifact_paths(base_path):
+    """Returns the (vectors, metadata) paths of a binary embedding artifact."""
+    base_path = os.path.splitext(base_path)[0]
+    return base_path + ".npy", base_path + ".meta.jsonl"
+
+
+def save_embedding_artifact(
+    df,
+    vectors,
+    base_path,
+    dtype="float32",
+    ):
+    """
+    Saves embeddings as a memory-mappable `.npy` matrix plus a JSONL metadata sidecar.
+
+    Args:
+        df (pd.DataFrame): Row metadata, aligned with `vectors` (no embedding column).
+        vectors (array-like): An (n_rows, dim) matrix of embeddings.
+        base_path (str): The artifact path without extension (an extension is ignored).
+        dtype (str): 'float32' or 'float16'.
+    """
+    vectors_path, meta_path = artifact_paths(base_path)
+    matrix = np.asarray(vectors, dtype=dtype)
+    if matrix.ndim != 2 or len(matrix) != len(df):
+        raise ValueError(f"Expected a ({len(df)}, dim) matrix, got shape {matrix.shape}")
+
+    output_dir = os.path.dirname(vectors_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # 메타데이터를 먼저 교체하고 벡터 파일을 마지막에 교체 (감시자는 .npy 변경을 기준으로 다시 로드)
+    df.to_json(meta_path + ".tmp", orient="records", lines=True, force_ascii=False)
+    os.replace(meta_path + ".tmp", meta_path)
+    with open(vectors_path + ".tmp", "wb") as f:
+        np.save(f, matrix)
+    os.replace(vectors_path + ".tmp", vectors_path)
+
+
+def load_embedding_artifact(
+    base_path,
+    mmap=True,
+    ):
+    """
+    Opens an artifact written by save_embedding_artifact.
+
+    Args:
+        base_path (str): The artifact path (with or without extension).
+        mmap (bool): Memory-map the vectors instead of reading them into memory.
+
+    Returns:
+        tuple: (metadata DataFrame, read-only vector matrix)
+    """
+    vectors_path, meta_path = artifact_paths(base_path)
+    vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+    metadata = pd.read_json(meta_path, orient="records", lines=True, dtype=False)
+    if len(metadata) != len(vectors):
+        raise ValueError(
+            f"Artifact mismatch: {len(metadata)} metadata rows vs {len(vectors)} vectors in {vectors_path}"
+        )
+    return metadata, vectors
+
+
+class EmbeddingStore:
+    """
+    An append-only JSONL store of embeddings keyed by a hash of the model name and text.
+
+    Each appended batch is flushed and fsynced, so it doubles as a checkpoint: an
+    interrupted run keeps every completed batch and a rerun only embeds what is left.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the JSONL store file. Created on first write.
+        """
+        self.path = path
+        self._vectors = {}
+        self._truncated_tail = False
+        self._load()
+
+    @staticmethod
+    def content_hash(model_name, text):
+        return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._vectors[record["key"]] = record["embedding"]
+                except (json.JSONDecodeError, KeyError):
+                    # 중단된 실행이 남긴 잘린 마지막 줄은 무시
+                    continue
+            # 잘린 줄 뒤에 새 기록이 이어 붙지 않도록 표시
+            self._truncated_tail = f.tell() > 0 and not line.endswith("\n")
+
+    def __contains__(self, key):
+        return key in self._vectors
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def get(self, key):
+        return self._vectors.get(key)
+
+    def add_batch(self, items):
+        """
+        Appends (key, embedding) pairs and flushes them to disk.
+
+        Args:
+            items (list[tuple[str, list[float]]]): The embedded batch.
+        """
+        store_dir = os.path.dirname(self.path)
+        if store_dir:
+            os.makedirs(store_dir, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._truncated_tail:
+                f.write("\n")
+                self._truncated_tail = False
+            for key, embedding in items:
+                embedding = [float(x) for x in embedding]
+                self._vectors[key] = embedding
+                f.write(json.dumps({"key": key, "embedding": embedding}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, keys):
+        """Rewrites the store keeping only `keys`, dropping embeddings of removed or edited rows."""
+        self._vectors = {key: self._vectors[key] for key in keys if key in self._vectors}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for key, embedding in self._vectors.items():
+                f.write(json.dumps({"key": key, "embedding": embedding}) + "\n")
+        os.replace(tmp_path, self.path)
+
+
+# 병렬 임베딩 워커 프로세스마다 한 번만 로드되는 모델
+_worker_model = None
+
+
+def _init_embedding_worker(
+    model_name,
+    num_threads,
+    ):
+    """Loads the model once per worker process and limits its intra-op threads."""
+    global _worker_model
+    import torch
+    # 워커끼리 코어를 나눠 쓰도록 워커당 연산 스레드 수를 제한
+    torch.set_num_threads(num_threads)
+    _worker_model = get_embedding_model(model_name)
+
+
+def _encode_in_worker(
+    texts,
+    batch_size,
+    ):
+    return _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+
+
+class AsyncTokenBucket:
+    """
+    A token-bucket rate limiter for asyncio code.
+
+    Tokens refill continuously at `rate` per second up to `capacity`; `acquire`
+    waits until enough tokens are available.
+    """
+    def __init__(
+        self,
+        rate,
+        capacity=1,
+        ):
+        """
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): The maximum burst size.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+# 재시도해도 결과가 바뀌지 않는 HTTP 오류 코드 (잘못된 요청, 인증 실패 등)
+NON_RETRYABLE_STATUS_CODES = {400, 401, 403, 404}
+
 
 class JsonEmbedder:
     """
@@ -39,6 +571,11 @@ class JsonEmbedder:
         model_name,
         output_path_tpl,
         api_key=None,
+        num_workers=1,
+        requests_per_minute=None,
+        max_concurrency=8,
+        max_retries=5,
+        base_url=None,
         ):
         """
         Initializes the embedder and configures the Gemini API.
@@ -49,10 +586,25 @@ class JsonEmbedder:
             api_key (str, optional): Your Google API key. If not provided,
                                      it will be read from the GOOGLE_API_KEY
                                      environment variable. Defaults to None.
+            num_workers (int, optional): The number of worker processes used to embed
+                                         with a local SentenceTransformer model. Each worker
+                                         loads its own model once. Defaults to 1 (in-process).
+            requests_per_minute (float, optional): Gemini request quota enforced with a token
+                                                   bucket. None disables rate limiting.
+            max_concurrency (int, optional): The maximum number of in-flight Gemini requests.
+            max_retries (int, optional): Retries per failed Gemini batch, with exponential backoff.
+            base_url (str, optional): Overrides the Gemini API endpoint, e.g. a local stub
+                                      HTTP server serving `/v1beta/models/{model}:batchEmbedContents`.
         """
 
         self.api_key = api_key
         self.model_name = model_name
+        self.num_workers = num_workers
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.failure_report = []
         self._init_model()
         self.concated_outpath = output_path_tpl.format(
             model_name=self.result_postfix,
@@ -62,15 +614,23 @@ class JsonEmbedder:
     def _init_model(self):
         
         if 'gemini' in self.model_name:
+            http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
             if self.api_key:
-                self.model = Client(api_key=self.api_key)
+                self.model = Client(api_key=self.api_key, http_options=http_options)
             elif "GOOGLE_API_KEY" in os.environ:
-                self.model = Client(api_key=os.environ["GOOGLE_API_KEY"])
+                self.model = Client(api_key=os.environ["GOOGLE_API_KEY"], http_options=http_options)
             else:
                 raise ValueError("Google API Key not provided or set in GOOGLE_API_KEY environment variable.")
             self.result_postfix = self.model_name
+        elif self.num_workers > 1:
+            # 모델은 워커 프로세스마다 로드하므로 부모 프로세스는 길이 정렬용 토크나이저만 로드
+            from transformers import AutoTokenizer
+            self.model = None
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.result_postfix = self.model_name.split("/")[-1]
         else:
-            self.model = SentenceTransformer(self.model_name)
+            self.model = get_embedding_model(self.model_name)
+            self.tokenizer = getattr(self.model, "tokenizer", None)
             self.result_postfix = self.model_name.split("/")[-1]
             
     def _embed_texts(
@@ -86,37 +646,208 @@ class JsonEmbedder:
 
         Returns:
             list: A list of embedding vectors.
+
+        Raises:
+            Exception: Any error from the model; callers record it in the failure report.
         """
+        if "gemini" in self.model_name:
+            _embeddings = self.model.models.embed_content(
+                model=self.model_name,
+                contents=texts,
+                config=types.EmbedContentConfig(output_dimensionality=embedding_dim)
+            ).embeddings
+            embeddings = [embedding.values for embedding in _embeddings]
+
+        else:
+            embeddings = self.model.encode(texts, show_progress_bar=True)
+        return embeddings
+
+    async def _aembed_texts(
+        self,
+        texts,
+        embedding_dim=1024,
+        ):
+        """Embeds a list of texts with the async Gemini client."""
+        response = await self.model.aio.models.embed_content(
+            model=self.model_name,
+            contents=texts,
+            config=types.EmbedContentConfig(output_dimensionality=embedding_dim)
+        )
+        embeddings = [embedding.values for embedding in response.embeddings]
+        if len(embeddings) != len(texts):
+            raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    def _record_failure(
+        self,
+        batch,
+        error,
+        attempts=1,
+        ):
+        self.failure_report.append({
+            "keys": [key for key, _ in batch],
+            "rows": len(batch),
+            "attempts": attempts,
+            "error": repr(error),
+        })
+        print(f"An error occurred during embedding ({len(batch)} rows, {attempts} attempts): {error}")
+
+    async def _aembed_batches(
+        self,
+        batches,
+        on_batch,
+        ):
+        """
+        Embeds batches concurrently with the Gemini async client.
+
+        Requests are bounded by `max_concurrency` and paced by a token bucket when
+        `requests_per_minute` is set. Only failed batches are retried, with
+        exponential backoff and jitter; batches that still fail go to the failure report.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        bucket = None
+        if self.requests_per_minute:
+            bucket = AsyncTokenBucket(rate=self.requests_per_minute / 60, capacity=self.max_concurrency)
+        progress = tqdm(total=len(batches))
+
+        async def _run(batch):
+            texts = [text for _, text in batch]
+            for attempt in range(1, self.max_retries + 2):
+                try:
+                    async with semaphore:
+                        if bucket is not None:
+                            await bucket.acquire()
+                        embeddings = await self._aembed_texts(texts)
+                    on_batch(batch, embeddings)
+                    progress.update(1)
+                    return
+                except Exception as e:
+                    retryable = getattr(e, "code", None) not in NON_RETRYABLE_STATUS_CODES
+                    if not retryable or attempt > self.max_retries:
+                        self._record_failure(batch, e, attempts=attempt)
+                        progress.update(1)
+                        return
+                    # 지수 백오프 + 지터 (최대 60초)
+                    await asyncio.sleep(min(60, 2 ** (attempt - 1)) * (0.5 + random.random() / 2))
+
+        await asyncio.gather(*(_run(batch) for batch in batches))
+        progress.close()
+        
+    def _sort_by_token_length(self, items):
+        """Orders (key, text) items by token count so each batch pads to a similar length."""
+        texts = [text for _, text in items]
+        if self.tokenizer is not None:
+            lengths = [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+        else:
+            lengths = [len(text) for text in texts]
+        order = sorted(range(len(items)), key=lambda i: lengths[i])
+        return [items[i] for i in order]
+
+    def _embed_batches(
+        self,
+        items,
+        batch_size,
+        on_batch,
+        ):
+        """
+        Embeds (key, text) items batch by batch and calls `on_batch(batch, embeddings)`
+        as each batch completes.
+        """
+        if "gemini" not in self.model_name:
+            # 로컬 모델은 길이가 비슷한 텍스트끼리 묶어 패딩 낭비를 줄임
+            items = self._sort_by_token_length(items)
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+        if "gemini" in self.model_name:
+            asyncio.run(self._aembed_batches(batches, on_batch))
+            return
+
+        if self.num_workers <= 1:
+            for batch in tqdm(batches):
+                try:
+                    on_batch(batch, self._embed_texts([text for _, text in batch]))
+                except Exception as e:
+                    self._record_failure(batch, e)
+            return
+
+        threads_per_worker = max(1, (os.cpu_count() or 1) // self.num_workers)
+        print(f"Embedding with {self.num_workers} worker processes ({threads_per_worker} threads each)...")
+        # torch가 로드된 프로세스를 fork하면 교착될 수 있으므로 spawn 사용
+        with ProcessPoolExecutor(
+            max_workers=self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_embedding_worker,
+            initargs=(self.model_name, threads_per_worker),
+        ) as executor:
+            futures = {
+                executor.submit(_encode_in_worker, [text for _, text in batch], batch_size): batch
+                for batch in batches
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                batch = futures[future]
+                try:
+                    on_batch(batch, future.result())
+                except Exception as e:
+                    self._record_failure(batch, e)
+
+    def _seed_store_from_output(
+        self,
+        store,
+        column_to_embed,
+        ):
+        """Imports embeddings from a previous full output (JSON or binary artifact) into an empty store."""
+        if len(store):
+            return
+        vectors_path, _ = artifact_paths(self.concated_outpath)
         try:
-            if "gemini" in self.model_name:
-                _embeddings = self.model.embed_content(
-                    model=self.model_name,
-                    contents=texts,
-                    config=types.EmbedContentConfig(output_dimensionality=embedding_dim)
-                ).embeddings
-                embeddings = [embedding.values for embedding in _embeddings]
-                
+            if os.path.exists(vectors_path):
+                previous, vectors = load_embedding_artifact(self.concated_outpath)
+                embeddings = list(vectors)
+            elif os.path.exists(self.concated_outpath):
+                previous = pd.read_json(self.concated_outpath)
+                embeddings = previous["embedding"]
             else:
-                embeddings = self.model.encode(texts, show_progress_bar=True)
-            return embeddings
+                return
         except Exception as e:
-            print(f"An error occurred during embedding: {e}")
-            return [None] * len(texts)
-        
+            print(f"Could not reuse previous output {self.concated_outpath}: {e}")
+            return
+        items = [
+            (EmbeddingStore.content_hash(self.model_name, str(text)), embedding)
+            for text, embedding in zip(previous[column_to_embed], embeddings)
+            if embedding is not None
+        ]
+        if items:
+            store.add_batch(items)
+            print(f"Seeded embedding store with {len(items)} rows from {self.concated_outpath}")
+
     def process_file(
         self,
         input_path,
         column_to_embed,
         batch_size=50,
+        store_path=None,
+        output_format="json",
+        dtype="float32",
         ):
         """
         Reads a JSON file, embeds a specified column, and saves the result.
 
+        Only rows whose text is not yet in the embedding store are embedded. Every
+        completed batch is checkpointed to the store, so an interrupted run resumes
+        where it stopped.
+
         Args:
             input_path (str): Path to the input JSON file.
             column_to_embed (str): The name of the column in the JSON file to embed.
             batch_size (int, optional): The number of texts to embed in each API call.
-                                       Defaults to 100.
+                                       Defaults to 50.
+            store_path (str, optional): Path to the content-hash embedding store.
+                                        Defaults to `<output path>.store.jsonl`.
+            output_format (str, optional): 'json' writes the records with embeddings as JSON.
+                                           'npy' writes a memory-mappable `.npy` matrix plus a
+                                           `.meta.jsonl` sidecar next to the output path.
+                                           Defaults to 'json'.
+            dtype (str, optional): Vector dtype of the 'npy' format ('float32' or 'float16').
         """
         print(f"Reading data from {input_path}...")
         try:
@@ -128,18 +859,51 @@ class JsonEmbedder:
             print(f"Error reading JSON file: {e}")
             return
 
-        
-        texts_to_embed = df[column_to_embed].astype(str).tolist()
-        all_embeddings = []
+        store = EmbeddingStore(store_path or self.concated_outpath + ".store.jsonl")
+        self._seed_store_from_output(store, column_to_embed)
+
+        texts = df[column_to_embed].astype(str).tolist()
+        keys = [EmbeddingStore.content_hash(self.model_name, text) for text in texts]
+
+        # 새로 추가되었거나 내용이 바뀐 행만 (중복 텍스트는 한 번만) 임베딩
+        pending = {}
+        for key, text in zip(keys, texts):
+            if key not in store and key not in pending:
+                pending[key] = text
+        pending_items = list(pending.items())
+        print(f"{len(texts) - len(pending_items)} rows reused from store, {len(pending_items)} rows to embed.")
 
-        print(f"Embedding column '{column_to_embed}' in batches of {batch_size}...")
-        for i in tqdm(range(0, len(texts_to_embed), batch_size)):
-            batch = texts_to_embed[i:i + batch_size]
-            embeddings = self._embed_texts(batch)
-                
-            all_embeddings.extend(embeddings)
+        def _checkpoint(batch, embeddings):
+            # 완료된 배치를 즉시 저장 (체크포인트)
+            store.add_batch([(key, embedding) for (key, _), embedding in zip(batch, embeddings)])
 
-        df['embedding'] = all_embeddings
+        self.failure_report = []
+        if pending_items:
+            print(f"Embedding column '{column_to_embed}' in batches of {batch_size}...")
+            self._embed_batches(pending_items, batch_size, _checkpoint)
+
+        missing = [key for key in keys if key not in store]
+        if missing:
+            # 일부 행이 비어 있는 출력을 쓰지 않고 실패 보고서를 남긴 뒤 중단
+            report_path = self.concated_outpath + ".failures.json"
+            with open(report_path, "w", encoding="utf-8") as f:
+                json.dump(self.failure_report, f, ensure_ascii=False, indent=2)
+            print(
+                f"Error: {len(missing)} rows could not be embedded ({len(self.failure_report)} failed batches, "
+                f"report: {report_path}). Rerun to resume; output was not written."
+            )
+            return
+
+        embeddings = [store.get(key) for key in keys]
+        store.compact(set(keys))
+
+        if output_format == "npy":
+            vectors_path, meta_path = artifact_paths(self.concated_outpath)
+            print(f"Saving {dtype} vectors to {vectors_path} and metadata to {meta_path}...")
+            save_embedding_artifact(df, embeddings, self.concated_outpath, dtype=dtype)
+            print("Processing complete.")
+            return
+        df['embedding'] = embeddings
 
         # Ensure the output directory exists
         output_dir = os.path.dirname(self.concated_outpath)
@@ -147,10 +911,13 @@ class JsonEmbedder:
             os.makedirs(output_dir, exist_ok=True)
 
         print(f"Saving data with embeddings to {self.concated_outpath}...")
+        # 쓰는 도중 중단되어도 기존 출력이 깨지지 않도록 임시 파일에 쓴 뒤 교체
+        tmp_path = self.concated_outpath + ".tmp"
         df.to_json(
-            self.concated_outpath,
+            tmp_path,
             orient='records',
             indent=4,
             force_ascii=False,
         )
-        print("Processing complete.")
\ No newline at end of file
+        os.replace(tmp_path, self.concated_outpath)
+        print("Processing complete.")
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import threading
+import time
+from Settings import warmup_retry_interval
+from Settings import warmup_retry_max_interval
+from Metrics import STARTUP_DURATION_SECONDS
+from Metrics import WARMUP_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+class ReadinessTracker:
+    """
+    Tracks the warmup state of each startup stage.
+    The server is ready only when every registered stage has succeeded.
+    """
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def register(self, name):
+        with self._lock:
+            self._stages.setdefault(name, {"status": "pending", "attempts": 0, "seconds": None, "error": None})
+
+    def attempt(self, name):
+        with self._lock:
+            self._stages[name]["attempts"] += 1
+
+    def succeed(self, name, seconds):
+        with self._lock:
+            self._stages[name].update(status="ready", seconds=round(seconds, 3), error=None)
+
+    def fail(self, name, error):
+        with self._lock:
+            self._stages[name].update(status="retrying", error=f"{type(error).__name__}: {error}")
+
+    def is_ready(self, name):
+        with self._lock:
+            return self._stages.get(name, {}).get("status") == "ready"
+
+    def stats(self):
+        """Returns the overall readiness and the status, attempts and duration of each stage."""
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self._stages.items()}
+        return {
+            "ready": bool(stages) and all(stage["status"] == "ready" for stage in stages.values()),
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "stages": stages,
+        }
+
+
+async def _run_stage(
+    tracker,
+    name,
+    stage,
+    ):
+    delay = warmup_retry_interval
+    while True:
+        tracker.attempt(name)
+        start = time.perf_counter()
+        try:
+            result = stage()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            # DB가 잠시 내려가 있는 경우 등: 서버는 계속 떠 있고 해당 단계만 간격을 늘려가며 재시도
+            WARMUP_FAILURES.inc(stage=name)
+            tracker.fail(name, e)
+            logger.warning(
+                "워밍업 단계 실패, 재시도 예정",
+                extra={"stage": name, "error": str(e), "retry_in_seconds": delay},
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, warmup_retry_max_interval)
+            continue
+        seconds = time.perf_counter() - start
+        STARTUP_DURATION_SECONDS.observe(seconds, phase=name)
+        tracker.succeed(name, seconds)
+        logger.info("워밍업 단계 완료", extra={"stage": name, "seconds": round(seconds, 3)})
+        return
+
+
+async def run_warmup(
+    tracker,
+    stages,
+    ):
+    """
+    (이름, 함수) 목록의 워밍업 단계를 동시에 실행합니다.
+    동기 함수는 이벤트 루프를 막지 않도록 스레드에서 실행하고, 실패한 단계는 다른 단계와 관계없이 성공할 때까지 재시도합니다.
+    """
+    for name, _ in stages:
+        tracker.register(name)
+    await asyncio.gather(*(
+        _run_stage(tracker, name, stage if asyncio.iscoroutinefunction(stage) else lambda stage=stage: asyncio.to_thread(stage))
+        for name, stage in stages
+    ))
+    logger.info("워밍업 완료", extra=tracker.stats())
@@ -1,4 +1,18 @@
+import time
+# 서버 시작 비용 측정: 이 모듈의 import(의존 모듈 포함)에 걸린 시간을 /ready와 /metrics로 확인
+_import_started = time.perf_counter()
+from contextlib import asynccontextmanager
+from contextlib import suppress
+import asyncio
+import json
+import threading
+from typing import List
+from typing import Optional
 from fastapi import FastAPI
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import numpy as np
 from psycopg2.extensions import register_adapter
@@ -6,41 +20,376 @@ from psycopg2.extensions import AsIs
 import uvicorn
 
 from Compile_graph import get_compiled_graph
+from Compile_graph import get_retrieval_graph
+from Settings import embedding_model_name
+from Settings import batch_max_concurrency
+from Settings import batch_max_prompts
+from Settings import warmup_llm_call
+from Settings import llm_cache_enabled
+from Utils import embedding_registry
+from Utils import get_db_pool
+from Utils import get_llm_cache
+from Retrievers import get_retrieval_backend
+from Retrievers import InMemoryVectorBackend
+from Curriculum import get_requirements_extractor
+from Curriculum import retrieval_group_key
+from Curriculum import get_basecode_index
+from Metrics import registry as metrics_registry
+from Metrics import instrument_node
+from Metrics import COALESCED_REQUESTS
+from Metrics import GRAPH_EXECUTIONS
+from Metrics import STARTUP_DURATION_SECONDS
+from Caches import SingleFlight
+from Nodes import extract_requirements_node
+from Nodes import get_llm
+from Helper_functions import query_embedding_cache
+from Helper_functions import grade_verdict_cache
+from Helper_functions import embed_query
+from Helper_functions import search_metadata
+from Warmup import ReadinessTracker
+from Warmup import run_warmup
+from Logger import setup_logging
+from Logger import stop_logging
 
+# print 대신 큐 기반 비동기 JSON 로그 사용 (노드가 로그 출력 I/O로 블로킹되지 않음)
+setup_logging()
 
+# LangGraph 애플리케이션은 import 시점이 아니라 최초 사용(또는 워밍업) 시점에 컴파일
+_app = None
+_retrieval_app = None
+_graph_lock = threading.Lock()
 
-# LangGraph 애플리케이션 컴파일
-app = get_compiled_graph()
+def get_app():
+    """요청 처리용 전체 그래프를 반환합니다."""
+    global _app
+    with _graph_lock:
+        if _app is None:
+            _app = get_compiled_graph()
+        return _app
+
+def get_retrieval_app():
+    """배치 처리에서 검색 결과를 공유하기 위한 검색/평가 전용 그래프를 반환합니다."""
+    global _retrieval_app
+    with _graph_lock:
+        if _retrieval_app is None:
+            _retrieval_app = get_retrieval_graph()
+        return _retrieval_app
 
 
 # pgvector가 numpy.float32 타입을 인식할 수 있도록 어댑터 등록
 register_adapter(np.float32, lambda a: AsIs(a.item()))
 
+# 워밍업용 더미 요청 (규칙 기반 추출로 해석되는 프롬프트)
+WARMUP_PROMPT = "고등학교 1학년 수학 '집합'"
+readiness = ReadinessTracker()
+
+def _warmup_graph():
+    get_app()
+    get_retrieval_app()
+
+def _warmup_requirements_extractor():
+    if get_requirements_extractor().extract(WARMUP_PROMPT, record_stats=False) is None:
+        raise RuntimeError("규칙 기반 추출기가 워밍업 프롬프트를 해석하지 못했습니다.")
+
+def _warmup_embedding_model():
+    embedding_registry.warmup([embedding_model_name])
+
+async def _warmup_llm():
+    llm = get_llm()
+    # 실제 호출은 요금/쿼터를 사용하므로 WARMUP_LLM_CALL=true일 때만 수행
+    if warmup_llm_call:
+        await llm.ainvoke("ping")
+
+def _warmup_retrieval():
+    # 메모리 인덱스 백엔드는 인덱스를 만들고 원본 변경을 감시, pgvector는 커넥션 풀을 열고 실제 검색까지 수행
+    backend = get_retrieval_backend()
+    if isinstance(backend, InMemoryVectorBackend):
+        backend.start_auto_refresh()
+    search_metadata(embed_query(WARMUP_PROMPT), k=1)
+
+def _warmup_basecode_index():
+    get_basecode_index()
+
+# 각 단계는 동시에 실행되므로 DB가 잠시 내려가 검색 단계가 재시도 중이어도 나머지 단계는 먼저 준비됨
+WARMUP_STAGES = [
+    ("graph", _warmup_graph),
+    ("embedding_model", _warmup_embedding_model),
+    ("llm", _warmup_llm),
+    ("retrieval", _warmup_retrieval),
+    ("basecode_index", _warmup_basecode_index),
+    ("requirements_extractor", _warmup_requirements_extractor),
+]
+
+@asynccontextmanager
+async def lifespan(server: FastAPI):
+    # 첫 요청이 모델 로딩/그래프 컴파일/DB 연결 비용을 부담하지 않도록 모든 단계를 백그라운드에서 워밍업
+    # 서버는 바로 요청을 받으며, 준비 완료 여부는 /ready로 확인
+    warmup_task = asyncio.create_task(run_warmup(readiness, WARMUP_STAGES))
+    yield
+    warmup_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await warmup_task
+    if readiness.is_ready("retrieval"):
+        backend = get_retrieval_backend()
+        if isinstance(backend, InMemoryVectorBackend):
+            backend.stop_auto_refresh()
+    get_db_pool().close()
+    stop_logging()
+
 # FastAPI 애플리케이션 생성
 server = FastAPI(
     title="Study Agent API",
     description="LangGraph RAG Agent를 이용한 학습 콘텐츠 생성 API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # 요청 본문을 위한 Pydantic 모델 정의
 class PromptRequest(BaseModel):
     prompt: str
 
+class BatchPromptRequest(BaseModel):
+    prompts: List[str]
+    max_concurrency: Optional[int] = None
+
+# 동시에 들어온 동일한 요청은 하나의 그래프 실행 결과를 공유
+# 1) 정규화한 프롬프트가 같으면 요구사항 추출부터 공유
+# 2) 프롬프트는 달라도 추출된 요구사항이 같으면 검색/평가/생성을 공유
+prompt_flight = SingleFlight(on_coalesced=lambda: COALESCED_REQUESTS.inc(stage="prompt"))
+requirements_flight = SingleFlight(on_coalesced=lambda: COALESCED_REQUESTS.inc(stage="requirements"))
+_extract_requirements = instrument_node("extract_requirements", extract_requirements_node)
+
+def _normalize_prompt(prompt):
+    return " ".join(str(prompt).split()).lower()
+
+def _requirements_key(requirements):
+    values = requirements.model_dump()
+    values["content_requests"] = sorted(values["content_requests"])
+    return json.dumps(
+        {key: _normalize_prompt(value) if isinstance(value, str) else value for key, value in values.items()},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+
+async def _run_graph(prompt, requirements):
+    GRAPH_EXECUTIONS.inc(endpoint="generate")
+    # 요구사항을 함께 넘기면 그래프는 추출 노드를 건너뜀
+    return await get_app().ainvoke({"prompt": prompt, "requirements": requirements})
+
+async def _generate_for_prompt(prompt):
+    extracted = await _extract_requirements({"prompt": prompt})
+    requirements = extracted["requirements"]
+    return await requirements_flight.do(
+        _requirements_key(requirements),
+        lambda: _run_graph(prompt, requirements),
+    )
+
 @server.post("/generate", summary="학습 콘텐츠 생성", description="사용자 프롬프트에 기반하여 학습 목표와 연습 문제를 생성합니다.")
-def generate_content(request: PromptRequest):
+async def generate_content(request: PromptRequest):
     """
     사용자로부터 프롬프트를 받아 LangGraph RAG 에이전트를 실행하고,
     생성된 학습 콘텐츠를 반환합니다.
 
     - **prompt**: 사용자가 입력한 학습 콘텐츠 생성 요청 문자열.
     """
-    inputs = {"prompt": request.prompt}
-    # LangGraph를 동기적으로 실행하고 최종 결과를 받습니다.
-    final_state = app.invoke(inputs)
+    # LangGraph를 비동기로 실행하여 요청마다 스레드를 점유하지 않도록 합니다.
+    # 같은 프롬프트나 같은 요구사항으로 이미 실행 중인 그래프가 있으면 그 결과를 함께 받습니다.
+    final_state = await prompt_flight.do(
+        _normalize_prompt(request.prompt),
+        lambda: _generate_for_prompt(request.prompt),
+    )
     # 최종 응답을 JSON 형태로 반환합니다.
     return {"response": final_state['final_response']}
 
+# 토큰을 스트리밍할 노드 (구조화된 출력을 사용하는 요구사항 추출/평가 노드는 제외)
+TOKEN_STREAMING_NODES = ("generate_learning_goals", "generate_problems")
+# 통합 생성은 구조화된 출력(JSON)이라 토큰 단위로 보여줄 수 없으므로 스트리밍에서는 분리 생성을 사용
+STREAM_CONFIG = {"configurable": {"combined_generation": False}}
+
+def _sse_event(event, data):
+    """Server-Sent Events 형식의 메시지 문자열을 만듭니다."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _message_text(message):
+    content = message.content
+    if isinstance(content, str):
+        return content
+    # 멀티파트 응답은 텍스트 파트만 이어붙임
+    return "".join(
+        part.get("text", "") for part in content if isinstance(part, dict)
+    )
+
+async def _stream_graph_events(inputs):
+    """
+    graph.astream의 updates/messages 모드를 SSE 이벤트로 변환합니다.
+    - progress: 노드 실행 완료
+    - token: 생성 노드의 LLM 토큰
+    - final: 최종 응답
+    """
+    try:
+        async for mode, chunk in get_app().astream(inputs, config=STREAM_CONFIG, stream_mode=["updates", "messages"]):
+            if mode == "messages":
+                message, metadata = chunk
+                node = metadata.get("langgraph_node")
+                text = _message_text(message)
+                if node in TOKEN_STREAMING_NODES and text:
+                    yield _sse_event("token", {"node": node, "content": text})
+            else:
+                for node, update in chunk.items():
+                    yield _sse_event("progress", {"node": node})
+                    if isinstance(update, dict) and update.get("final_response"):
+                        yield _sse_event("final", {"response": update["final_response"]})
+    except Exception as e:
+        yield _sse_event("error", {"message": str(e)})
+    yield _sse_event("done", {})
+
+@server.post("/generate/stream", summary="학습 콘텐츠 스트리밍 생성", description="노드 진행 상황과 생성 토큰을 Server-Sent Events로 스트리밍합니다.")
+async def generate_content_stream(request: PromptRequest):
+    """
+    `/generate`와 같은 그래프를 실행하되, 최종 응답을 기다리지 않고
+    노드 진행 이벤트와 생성 토큰을 도착하는 즉시 전송합니다.
+
+    - **prompt**: 사용자가 입력한 학습 콘텐츠 생성 요청 문자열.
+    """
+    inputs = {"prompt": request.prompt}
+    return StreamingResponse(
+        _stream_graph_events(inputs),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# 배치 결과에 포함할 공유 검색 결과 필드 (그래프 상태 중 생성 단계로 넘길 값)
+SHARED_RETRIEVAL_FIELDS = ("retrieved_docs", "metadata", "binary_score", "retrieval_attempt", "rejected_basecodes")
+
+def _ndjson(data):
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+async def _stream_batch(prompts, max_concurrency):
+    """
+    여러 프롬프트를 프롬프트별 파이프라인으로 처리하고, 생성이 끝난 항목부터 NDJSON 한 줄씩 전송합니다.
+    1) 요구사항 추출
+    2) 학교급/학년/과목/주제가 같은 프롬프트끼리 묶어 그룹마다 검색과 관련성 평가를 한 번만 실행
+       (그룹의 첫 프롬프트가 검색을 시작하고, 같은 그룹의 나머지 프롬프트는 그 결과를 기다림)
+    3) 공유한 검색 결과를 채운 상태로 그래프를 실행해 콘텐츠 생성
+    단계 사이에 전체 배치를 기다리는 구간이 없으므로, 검색이 끝난 그룹의 항목은 다른 그룹과 관계없이 바로 생성을 시작합니다.
+    모든 단계의 LLM/DB 작업은 같은 세마포어로 최대 max_concurrency개만 동시에 실행합니다.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    groups = {}
+
+    async def _retrieve(prompt, requirements):
+        GRAPH_EXECUTIONS.inc(endpoint="batch_retrieval")
+        async with semaphore:
+            return await get_retrieval_app().ainvoke({"prompt": prompt, "requirements": requirements})
+
+    async def _process(index, prompt):
+        try:
+            async with semaphore:
+                requirements = (await _extract_requirements({"prompt": prompt}))["requirements"]
+        except Exception as e:
+            return {"index": index, "prompt": prompt, "error": f"요구사항 추출 오류: {e}"}
+
+        # 그룹마다 먼저 도착한 프롬프트 하나로 임베딩/검색/평가를 한 번만 실행
+        key = retrieval_group_key(requirements)
+        if key not in groups:
+            groups[key] = asyncio.ensure_future(_retrieve(prompt, requirements))
+        try:
+            # 한 항목이 취소되어도 같은 그룹의 공유 검색은 취소되지 않도록 보호
+            group_state = await asyncio.shield(groups[key])
+        except Exception as e:
+            return {"index": index, "prompt": prompt, "error": f"검색 오류: {e}"}
+
+        shared = {field: group_state[field] for field in SHARED_RETRIEVAL_FIELDS if field in group_state}
+        GRAPH_EXECUTIONS.inc(endpoint="batch")
+        try:
+            async with semaphore:
+                final_state = await get_app().ainvoke({"prompt": prompt, "requirements": requirements, **shared})
+        except Exception as e:
+            return {"index": index, "prompt": prompt, "error": str(e)}
+        return {"index": index, "prompt": prompt, "response": final_state["final_response"]}
+
+    tasks = [asyncio.ensure_future(_process(index, prompt)) for index, prompt in enumerate(prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield _ndjson(await next_done)
+    finally:
+        # 클라이언트 연결이 끊겨 스트림이 중단되면 남은 작업을 정리
+        for task in tasks + list(groups.values()):
+            task.cancel()
+
+    yield _ndjson({"summary": {"prompts": len(prompts), "retrieval_groups": len(groups)}})
+
+@server.post("/generate/batch", summary="학습 콘텐츠 배치 생성", description="여러 프롬프트를 제한된 동시성으로 처리하고, 완료된 항목부터 NDJSON으로 스트리밍합니다.")
+async def generate_content_batch(request: BatchPromptRequest):
+    """
+    여러 프롬프트에 대한 학습 콘텐츠를 한 번에 생성합니다.
+    같은 학교급/학년/과목/주제로 해석되는 프롬프트는 임베딩, 검색, 관련성 평가를 공유합니다.
+
+    - **prompts**: 학습 콘텐츠 생성 요청 문자열 목록.
+    - **max_concurrency**: 동시에 처리할 최대 프롬프트 수 (기본값: BATCH_MAX_CONCURRENCY).
+    """
+    if not request.prompts:
+        raise HTTPException(status_code=422, detail="prompts must not be empty")
+    if len(request.prompts) > batch_max_prompts:
+        raise HTTPException(status_code=422, detail=f"At most {batch_max_prompts} prompts are allowed per batch")
+    max_concurrency = max(1, min(request.max_concurrency or batch_max_concurrency, batch_max_concurrency))
+    return StreamingResponse(
+        _stream_batch(request.prompts, max_concurrency),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@server.get("/embedding_models", summary="임베딩 모델 상태", description="로드된 임베딩 모델별 로딩 시간과 메모리 사용량을 반환합니다.")
+def embedding_models():
+    return embedding_registry.stats()
+
+@server.get("/db_pool", summary="DB 커넥션 풀 상태", description="커넥션 대기 시간과 풀 포화도 지표를 반환합니다.")
+def db_pool_stats():
+    return get_db_pool().stats()
+
+@server.get("/metrics", summary="Prometheus 지표", description="노드별 실행 시간, LLM 토큰 수, 관련성 평가 호출 수, DB 조회 시간을 Prometheus 텍스트 형식으로 반환합니다.", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@server.get("/coalescing", summary="중복 요청 병합 통계", description="동일한 프롬프트/요구사항으로 병합된 요청 수와 실제 실행 수를 반환합니다.")
+def coalescing_stats():
+    return {
+        "prompt": prompt_flight.stats(),
+        "requirements": requirements_flight.stats(),
+    }
+
+@server.get("/caches", summary="프로세스 내 캐시 통계", description="쿼리 임베딩 캐시와 관련성 평가 결과 캐시의 크기, 적중/미스/제거 횟수와 적중률을 반환합니다.")
+def cache_stats():
+    return {
+        "query_embedding": query_embedding_cache.stats(),
+        "grade_verdict": grade_verdict_cache.stats(),
+    }
+
+@server.get("/llm_cache", summary="LLM 응답 캐시 통계", description="SQLite LLM 응답 캐시의 항목 수, 적중/미스/제거 횟수와 적중률을 반환합니다.")
+def llm_cache_stats():
+    # 비활성화 상태에서는 캐시 파일을 만들지 않도록 조회하지 않음
+    if not llm_cache_enabled:
+        return {"enabled": False}
+    return {"enabled": True, **get_llm_cache().stats()}
+
+@server.get("/extraction_stats", summary="요구사항 추출 경로 통계", description="규칙 기반 추출(fast path)과 LLM 추출 횟수 및 커버리지를 반환합니다.")
+def extraction_stats():
+    return get_requirements_extractor().stats()
+
+@server.get("/health", summary="생존 확인", description="프로세스가 요청에 응답할 수 있으면 항상 200을 반환합니다.")
+def health():
+    return {"status": "ok"}
+
+@server.get("/ready", summary="준비 상태", description="모든 워밍업 단계(그래프, 임베딩 모델, LLM, 검색, basecode 인덱스, 요구사항 추출기)가 끝나면 200, 아니면 503을 반환합니다.")
+def ready():
+    stats = readiness.stats()
+    stats["import_seconds"] = round(import_seconds, 3)
+    return JSONResponse(stats, status_code=200 if stats["ready"] else 503)
+
+# 모듈 import 시간 기록 (무거운 리소스는 위의 지연 초기화/워밍업으로 옮겨 import 시간에서 제외됨)
+import_seconds = time.perf_counter() - _import_started
+STARTUP_DURATION_SECONDS.observe(import_seconds, phase="import")
+
 # 서버 실행 (uvicorn)
 if __name__ == "__main__":
     uvicorn.run(server, host="0.0.0.0", port=8000)
\ No newline at end of file
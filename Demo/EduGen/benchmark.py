@@ -0,0 +1,468 @@
+# EduGen 파이프라인 단계별 오프라인 벤치마크
+# 네트워크, API 키, PostgreSQL 없이 결정적인 가짜 LLM과 해시 기반 임베딩 스텁, all_basecode.json만으로 실행됩니다.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --output new.json --baseline bench.json   # 회귀 비교 (허용 범위 초과 시 종료 코드 1)
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix="edugen_bench_")
+
+# Settings는 import 시점의 환경 변수를 읽으므로 다른 모듈보다 먼저 설정
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+os.environ["RETRIEVAL_BACKEND"] = "memory"
+os.environ["EMBEDDING_OUTPUT_FORMAT"] = "json"
+os.environ["EMBEDDED_DATA_PATH"] = os.path.join(WORK_DIR, "all_basecode_embeddings_bge-m3.json")
+os.environ["CURRICULUM_DATA_PATH"] = os.path.join(BENCH_DIR, "all_basecode.json")
+os.environ["BASECODE_INDEX_SOURCE"] = "json"
+os.environ["VECTOR_INDEX_REFRESH_INTERVAL"] = "0"
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, BENCH_DIR)
+
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from Settings import embedding_model_name
+from Settings import retrieval_k
+from Settings import grade_pass_ratio
+from States import GradeDocuments
+from States import Requirements
+from Logger import setup_logging
+from Metrics import LLM_CALLS
+from Metrics import LLM_TOKENS
+from Metrics import NODE_DURATION_SECONDS
+from Metrics import token_usage_handler
+from Utils import JsonEmbedder
+from Utils import embedding_registry
+from Retrievers import InMemoryVectorBackend
+from Curriculum import to_search_filters
+import Helper_functions
+import Nodes
+from Compile_graph import get_compiled_graph
+
+FAKE_MODEL_NAME = "fake-chat"
+GRAPH_NODES = (
+    "extract_requirements",
+    "retrieve_from_vectordb",
+    "lookup_basecode",
+    "evaluation_grade",
+    "generate_learning_goals",
+    "generate_problems",
+    "generate_combined",
+    "consolidate_response",
+    "error_handler",
+)
+DEFAULT_PROMPTS = (
+    "고등학교 1학년 수학 '집합'",
+    "중2 일차함수 문제 만들어줘",
+    "[2수01-01] 학습 목표와 문제",
+)
+
+
+def _digest(text):
+    return int(hashlib.sha256(str(text).encode("utf-8")).hexdigest(), 16)
+
+
+class HashEmbeddingModel:
+    """
+    SentenceTransformer 대신 사용하는 결정적 임베딩 스텁입니다.
+    문자 bigram을 해시하여 고정 차원 벡터에 더하므로 비슷한 텍스트는 비슷한 벡터가 됩니다.
+    """
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _encode_one(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = str(text)
+        for i in range(max(len(text) - 1, 1)):
+            vector[_digest(text[i:i + 2]) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, show_progress_bar=False, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts)
+        return np.stack([self._encode_one(text) for text in texts]) if texts else np.zeros((0, self.dim), np.float32)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    네트워크 없이 동작하는 결정적 채팅 모델입니다. 호출마다 `latency`초를 기다려 LLM 지연을 흉내 내고,
+    `with_structured_output`은 스키마에 맞는 JSON을 돌려줍니다.
+    """
+    latency: float = 0.0
+    grade_yes_ratio: float = 0.8
+
+    @property
+    def _llm_type(self):
+        return FAKE_MODEL_NAME
+
+    def _fake_structured(self, schema, text):
+        if schema is GradeDocuments:
+            relevant = _digest(text) % 100 < self.grade_yes_ratio * 100
+            return GradeDocuments(binary_score="yes" if relevant else "no")
+        if schema is Requirements:
+            # 규칙 기반 추출로 해석되지 않은 프롬프트만 여기에 도달하므로 고정된 요구사항을 반환
+            return Requirements(
+                school_level="중학교",
+                grade="2학년",
+                subject="수학",
+                content_requests=["학습 목표 생성", "문제 생성"],
+                domain="일차함수와 그 그래프",
+                basecode="",
+            )
+        # 그 외 스키마(통합 생성)는 문자열 필드를 분리 생성과 같은 길이의 결정적인 텍스트로 채움
+        return schema(**{
+            name: f"[{name}] " + self._fake_text(text)
+            for name in schema.model_fields
+        })
+
+    def _fake_text(self, text):
+        return f"[generated] {_digest(text) % 10 ** 8:08d} " + "내용 " * 64
+
+    def _respond(self, messages, schema=None):
+        text = "\n".join(str(message.content) for message in messages)
+        if schema is not None:
+            content = self._fake_structured(schema, text).model_dump_json()
+        else:
+            content = self._fake_text(text)
+        input_tokens, output_tokens = len(text) // 2, len(content) // 2
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"model_name": FAKE_MODEL_NAME})
+
+    def _generate(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, structured_schema)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, structured_schema=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, structured_schema)
+
+    def with_structured_output(self, schema, **kwargs):
+        return self.bind(structured_schema=schema) | RunnableLambda(
+            lambda message: schema.model_validate_json(message.content)
+        )
+
+
+def _latency_summary(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "max_ms": round(float(values.max()), 4),
+    }
+
+
+def bench_embed(args, model):
+    """JsonEmbedder.process_file: 전체 임베딩(cold)과 변경분 없는 재실행(incremental) 처리량"""
+    embedding_registry.register(embedding_model_name, model)
+    output_tpl = os.path.join(WORK_DIR, "all_basecode_embeddings_{model_name}.json")
+    input_path = os.environ["CURRICULUM_DATA_PATH"]
+    with open(input_path, "r", encoding="utf-8") as f:
+        rows = len(json.load(f))
+
+    results = {"rows": rows, "batch_size": args.batch_size}
+    for run in ("cold", "incremental"):
+        embedder = JsonEmbedder(embedding_model_name, output_tpl)
+        start = time.perf_counter()
+        embedder.process_file(input_path, "content", batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        results[f"{run}_seconds"] = round(elapsed, 4)
+        results[f"{run}_rows_per_second"] = round(rows / elapsed, 2)
+    return results
+
+
+def _synthetic_corpus(base_records, size, seed):
+    """기준 행을 복제하고 벡터에 잡음을 더해 원하는 크기의 코퍼스 파일을 만듭니다."""
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(size):
+        record = dict(base_records[i % len(base_records)])
+        if i >= len(base_records):
+            record["basecode"] = f"{record['basecode']}#{i // len(base_records)}"
+            vector = np.asarray(record["embedding"], dtype=np.float32)
+            record["embedding"] = (vector + rng.normal(0, 0.05, vector.shape)).astype(np.float32).tolist()
+        records.append(record)
+    path = os.path.join(WORK_DIR, f"corpus_{size}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, ensure_ascii=False)
+    return path
+
+
+def bench_search(args, model):
+    """메모리 인덱스 검색 지연 시간 (코퍼스 크기별, 필터 유무별)"""
+    with open(os.environ["EMBEDDED_DATA_PATH"], "r", encoding="utf-8") as f:
+        base_records = json.load(f)
+    queries = [model.encode(f"{record['school_level']} {record['grade']} 수학 {record['category']}")
+               for record in base_records[:args.queries]]
+    filters = to_search_filters(Requirements(
+        school_level="고등학교", grade="1학년", subject="수학",
+        content_requests=["문제 생성"], domain="집합", basecode="",
+    ))
+
+    results = {"queries": len(queries), "k": retrieval_k, "sizes": {}}
+    for size in args.sizes:
+        backend = InMemoryVectorBackend(_synthetic_corpus(base_records, size, args.seed), refresh_interval=0)
+        size_results = {}
+        for label, search_filters in (("unfiltered", None), ("filtered", filters)):
+            samples = []
+            for _ in range(args.repeat):
+                for query in queries:
+                    start = time.perf_counter()
+                    backend.search(query, k=retrieval_k, filters=search_filters)
+                    samples.append(time.perf_counter() - start)
+            size_results[label] = _latency_summary(samples)
+        results["sizes"][str(size)] = size_results
+
+    # 서비스 경로(search_metadata -> 설정된 백엔드) 지연 시간
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        Helper_functions.search_metadata(query, k=retrieval_k)
+        samples.append(time.perf_counter() - start)
+    results["search_metadata"] = _latency_summary(samples)
+    return results
+
+
+def bench_grade(args, model):
+    """grade_documents_concurrently: 가짜 LLM 지연을 준 관련성 평가 (문서 수별)"""
+    llm = FakeChatModel(latency=args.llm_latency, callbacks=[token_usage_handler])
+    grader = Helper_functions.get_grader(llm)
+    with open(os.environ["EMBEDDED_DATA_PATH"], "r", encoding="utf-8") as f:
+        docs = [
+            {col: str(record[col]) for col in ("basecode", "content", "school_level", "grade", "domain", "category")}
+            for record in json.load(f)
+        ]
+
+    results = {"llm_latency_seconds": args.llm_latency, "documents": {}}
+    for count in (retrieval_k, retrieval_k * 2, retrieval_k * 4):
+        threshold = int(round(count * grade_pass_ratio))
+        samples, graded_counts = [], []
+        for i in range(args.repeat):
+            batch = docs[i * count:(i + 1) * count]
+            start = time.perf_counter()
+            _, _, graded = asyncio.run(Helper_functions.grade_documents_concurrently(
+                grader, "고등학교 1학년 수학 집합", batch, threshold,
+            ))
+            samples.append(time.perf_counter() - start)
+            graded_counts.append(graded)
+        results["documents"][str(count)] = dict(
+            _latency_summary(samples),
+            mean_llm_calls=round(float(np.mean(graded_counts)), 2),
+        )
+    return results
+
+
+def _llm_totals():
+    return {
+        "calls": LLM_CALLS.value(model=FAKE_MODEL_NAME),
+        "input_tokens": LLM_TOKENS.value(model=FAKE_MODEL_NAME, type="input"),
+        "output_tokens": LLM_TOKENS.value(model=FAKE_MODEL_NAME, type="output"),
+    }
+
+
+def _node_totals():
+    return {node: NODE_DURATION_SECONDS.snapshot(node=node) for node in GRAPH_NODES}
+
+
+def _run_graph(args, graph, prompt, combined):
+    config = {"configurable": {"combined_generation": combined}}
+    samples = []
+    llm_before, nodes_before = _llm_totals(), _node_totals()
+    for _ in range(args.repeat):
+        Helper_functions.query_embedding_cache.clear()
+        Helper_functions.grade_verdict_cache.clear()
+        start = time.perf_counter()
+        asyncio.run(graph.ainvoke({"prompt": prompt}, config=config))
+        samples.append(time.perf_counter() - start)
+    llm_after, nodes_after = _llm_totals(), _node_totals()
+
+    node_ms = {}
+    for node in GRAPH_NODES:
+        count = nodes_after[node]["count"] - nodes_before[node]["count"]
+        if count:
+            node_ms[node] = round((nodes_after[node]["sum"] - nodes_before[node]["sum"]) / args.repeat * 1000, 4)
+    return dict(
+        _latency_summary(samples),
+        llm_calls_per_run=round((llm_after["calls"] - llm_before["calls"]) / args.repeat, 2),
+        llm_tokens_per_run=round(
+            (llm_after["input_tokens"] + llm_after["output_tokens"]
+             - llm_before["input_tokens"] - llm_before["output_tokens"]) / args.repeat, 1
+        ),
+        node_mean_ms=node_ms,
+    )
+
+
+def bench_graph(args, model):
+    """
+    get_compiled_graph().ainvoke: 프롬프트별 전체 그래프 실행 (매 실행마다 캐시 초기화)
+    콘텐츠 생성을 분리(split)/통합(combined) 모드로 각각 실행해 LLM 호출 수, 토큰, 지연 시간 절감을 비교합니다.
+    """
+    Nodes.set_llm(FakeChatModel(latency=args.llm_latency, callbacks=[token_usage_handler]))
+    graph = get_compiled_graph()
+
+    results = {"llm_latency_seconds": args.llm_latency, "prompts": {}}
+    for prompt in args.prompts:
+        # 먼저 실행하는 모드가 콜드 스타트 비용(인덱스 로드, 코드 경로 초기화 등)을 떠안지 않도록
+        # 두 모드를 한 번씩 측정 없이 실행한 뒤 측정
+        for combined in (False, True):
+            asyncio.run(graph.ainvoke({"prompt": prompt}, config={"configurable": {"combined_generation": combined}}))
+        split = _run_graph(args, graph, prompt, combined=False)
+        combined = _run_graph(args, graph, prompt, combined=True)
+        results["prompts"][prompt] = {
+            "split": split,
+            "combined": combined,
+            # 두 콘텐츠를 모두 요청하지 않은 프롬프트는 두 모드가 같으므로 절감량이 0
+            "combined_savings": {
+                "llm_calls_per_run": round(split["llm_calls_per_run"] - combined["llm_calls_per_run"], 2),
+                "llm_tokens_per_run": round(split["llm_tokens_per_run"] - combined["llm_tokens_per_run"], 1),
+                "mean_ms": round(split["mean_ms"] - combined["mean_ms"], 4),
+            },
+        }
+    return results
+
+
+STAGES = {
+    "embed": bench_embed,
+    "search": bench_search,
+    "grade": bench_grade,
+    "graph": bench_graph,
+}
+
+
+def _flatten(value, prefix=""):
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare(current, baseline, tolerance):
+    """
+    같은 지표끼리 비교하여 허용 범위를 넘게 나빠진 항목을 반환합니다.
+    *_ms, *_seconds는 낮을수록, *_per_second는 높을수록 좋은 지표로 봅니다.
+    """
+    current_flat, baseline_flat = _flatten(current["stages"]), _flatten(baseline.get("stages", {}))
+    comparisons, regressions = {}, []
+    for key, value in current_flat.items():
+        old = baseline_flat.get(key)
+        # 절감량은 두 모드의 차이라서 회귀 판단 대상에서 제외
+        if not old or key.endswith("llm_latency_seconds") or ".combined_savings." in key:
+            continue
+        if key.endswith("_per_second"):
+            change = (old - value) / old
+        elif key.endswith(("_ms", "_seconds")):
+            change = (value - old) / old
+        else:
+            continue
+        comparisons[key] = {"baseline": old, "current": value, "regression": round(change, 4)}
+        if change > tolerance:
+            regressions.append(key)
+    return comparisons, regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline EduGen pipeline benchmark")
+    parser.add_argument("--stages", default=",".join(STAGES), help="쉼표로 구분한 실행 단계")
+    parser.add_argument("--sizes", default="435,5000,20000", help="검색 벤치마크 코퍼스 크기 목록")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=256, help="임베딩 스텁 차원")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="가짜 LLM 호출당 지연 시간(초)")
+    parser.add_argument("--prompt", dest="prompts", action="append", help="그래프 벤치마크 프롬프트 (반복 지정 가능)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="결과 JSON 경로 (기본: 표준 출력)")
+    parser.add_argument("--baseline", help="비교할 이전 결과 JSON 경로")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="허용 회귀 비율 (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",") if size]
+    args.prompts = args.prompts or list(DEFAULT_PROMPTS)
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {sorted(unknown)}. Choose from {list(STAGES)}.")
+
+    setup_logging(os.environ["LOG_LEVEL"])
+    model = HashEmbeddingModel(args.dim)
+
+    report = {
+        "version": 1,
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "stages": {},
+    }
+    # 표준 출력은 결과 JSON 전용이므로 단계 실행 중 JsonEmbedder 등의 진행 메시지는 stderr로 보냄
+    with contextlib.redirect_stdout(sys.stderr):
+        # 검색/그래프 단계는 임베딩 결과 파일을 사용하므로 embed 단계가 빠져도 먼저 생성
+        if "embed" not in stages:
+            bench_embed(args, model)
+        for stage in stages:
+            print(f"Running benchmark stage: {stage}", file=sys.stderr)
+            report["stages"][stage] = STAGES[stage](args, model)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparisons, regressions = compare(report, baseline, args.tolerance)
+        report["comparison"] = {
+            "baseline_revision": baseline.get("git_revision"),
+            "tolerance": args.tolerance,
+            "metrics": comparisons,
+            "regressions": regressions,
+        }
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}: {regressions}", file=sys.stderr)
+            exit_code = 1
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
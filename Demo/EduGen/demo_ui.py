@@ -1,9 +1,45 @@
 import streamlit as st
 import requests
-import time
+import json
 
-# FastAPI 서버 주소
-FASTAPI_URL = "http://127.0.0.1:8000/generate"
+# FastAPI 서버 주소 (SSE 스트리밍 엔드포인트)
+FASTAPI_URL = "http://127.0.0.1:8000/generate/stream"
+
+# 노드 이름을 사용자에게 보여줄 진행 상황 문구로 변환
+NODE_LABELS = {
+    "extract_requirements": "요구사항을 분석했습니다.",
+    "retrieve_from_vectordb": "관련 교육과정을 검색했습니다.",
+    "lookup_basecode": "성취기준 코드로 교육과정을 조회했습니다.",
+    "evaluation_grade": "검색 결과를 검증했습니다.",
+    "generate_learning_goals": "학습 목표를 생성했습니다.",
+    "generate_problems": "연습 문제를 생성했습니다.",
+    "consolidate_response": "답변을 정리했습니다.",
+    "error_handler": "오류를 처리했습니다.",
+}
+SECTION_TITLES = {
+    "generate_learning_goals": "### 학습 목표",
+    "generate_problems": "### 연습 문제",
+}
+
+def iter_sse_events(response):
+    """SSE 응답에서 (event, data) 쌍을 순서대로 읽어옵니다."""
+    event, data_lines = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if event is not None:
+                yield event, json.loads("\n".join(data_lines) or "{}")
+            event, data_lines = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+def render_sections(sections):
+    return "\n\n".join(
+        f"{SECTION_TITLES[node]}\n{text}" for node, text in sections.items()
+    )
 
 # --- Streamlit UI 설정 ---
 st.set_page_config(page_title="Study Agent Chatbot", page_icon="🤖")
@@ -30,31 +66,38 @@ if prompt := st.chat_input("예: 고등학교 1학년 수학 '집합'"):
 
     # 어시스턴트 응답을 위한 준비
     with st.chat_message("assistant"):
-        # 로딩 스피너 표시
-        with st.spinner("에이전트가 생각 중입니다... 잠시만 기다려주세요."):
-            try:
-                # FastAPI 서버로 요청 전송 (5분 타임아웃)
-                response = requests.post(FASTAPI_URL, json={"prompt": prompt}, timeout=90)
+        status_container = st.status("에이전트가 생각 중입니다... 잠시만 기다려주세요.")
+        response_container = st.empty()
+        sections = {}
+        full_response = "죄송합니다, 응답을 생성하는 데 실패했습니다."
+        try:
+            # FastAPI 서버로 요청을 보내고 도착하는 이벤트를 즉시 화면에 반영
+            with requests.post(FASTAPI_URL, json={"prompt": prompt}, stream=True, timeout=90) as response:
                 response.raise_for_status()  # HTTP 오류 발생 시 예외 처리
 
-                data = response.json()
-                full_response = data.get("response", "죄송합니다, 응답을 생성하는 데 실패했습니다.")
+                for event, data in iter_sse_events(response):
+                    if event == "progress":
+                        status_container.write(NODE_LABELS.get(data["node"], data["node"]))
+                    elif event == "token":
+                        sections[data["node"]] = sections.get(data["node"], "") + data["content"]
+                        response_container.markdown(render_sections(sections) + "▌")
+                    elif event == "final":
+                        full_response = data["response"]
+                    elif event == "error":
+                        full_response = f"응답 생성 중 오류가 발생했습니다: {data['message']}"
+                        st.error(full_response)
+            status_container.update(label="완료", state="complete")
 
-            except requests.exceptions.RequestException as e:
-                full_response = f"서버 연결 오류: {e}\n\nFastAPI 서버(`app.py`)가 실행 중인지 확인해주세요."
-                st.error(full_response)
-            except Exception as e:
-                full_response = f"알 수 없는 오류가 발생했습니다: {e}"
-                st.error(full_response)
+        except requests.exceptions.RequestException as e:
+            full_response = f"서버 연결 오류: {e}\n\nFastAPI 서버(`app.py`)가 실행 중인지 확인해주세요."
+            status_container.update(label="오류", state="error")
+            st.error(full_response)
+        except Exception as e:
+            full_response = f"알 수 없는 오류가 발생했습니다: {e}"
+            status_container.update(label="오류", state="error")
+            st.error(full_response)
 
-        # 타이핑 효과를 주며 응답 표시
-        response_container = st.empty()
-        typed_response = ""
-        for chunk in full_response.split():
-            typed_response += chunk + " "
-            time.sleep(0.05)
-            response_container.markdown(typed_response + "▌")
-        response_container.markdown(typed_response)
+        response_container.markdown(full_response)
 
     # 최종 응답을 세션 상태에 저장
-    st.session_state.messages.append({"role": "assistant", "content": full_response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": full_response})
@@ -1,9 +1,46 @@
+import io
+import math
 import os
+import struct
+import numpy as np
 from psycopg2.extras import execute_values
 import pandas as pd
 from dotenv import load_dotenv
 from Utils import postgres_conn
 from Utils import JsonEmbedder
+from Utils import artifact_paths
+from Utils import load_embedding_artifact
+from Settings import embedding_output_format
+from Settings import embedding_dtype
+
+
+# PostgreSQL binary COPY 형식의 헤더(시그니처 + 플래그 + 헤더 확장 길이)와 트레일러
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+
+def _is_null(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _encode_vector(value):
+    # pgvector의 binary 표현: int16 차원, int16 예약(0), float4 * 차원 (big-endian)
+    values = np.asarray(value, dtype=">f4")
+    return struct.pack("!hh", len(values), 0) + values.tobytes()
+
+
+# PostgreSQL 타입별 binary COPY 인코더
+COPY_ENCODERS = {
+    "text": lambda v: str(v).encode("utf-8"),
+    "character varying": lambda v: str(v).encode("utf-8"),
+    "integer": lambda v: struct.pack("!i", int(v)),
+    "bigint": lambda v: struct.pack("!q", int(v)),
+    "smallint": lambda v: struct.pack("!h", int(v)),
+    "double precision": lambda v: struct.pack("!d", float(v)),
+    "real": lambda v: struct.pack("!f", float(v)),
+    "boolean": lambda v: b"\x01" if v else b"\x00",
+    "vector": _encode_vector,
+}
 
 
 class PostgresEmbeddingLoader:
@@ -83,6 +120,76 @@ class PostgresEmbeddingLoader:
         self.conn.commit()
         print(f"Table '{table_name}' created successfully.")
 
+    def _ivfflat_lists(
+        self,
+        table_name,
+        ):
+        """Returns the pgvector-recommended IVFFlat list count for the table's current size."""
+        self.cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+        rows = self.cursor.fetchone()[0]
+        # pgvector 권장값: 100만 행까지는 rows / 1000, 그 이상은 sqrt(rows)
+        lists = rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows))
+        return max(1, lists)
+
+    def create_indexes(
+        self,
+        table_name,
+        vector_col='embedding',
+        index_type='hnsw',
+        distance_ops='vector_cosine_ops',
+        metadata_cols=('school_level', 'grade', 'domain'),
+        hnsw_m=16,
+        hnsw_ef_construction=64,
+        ivfflat_lists=None,
+        ):
+        """
+        Creates an ANN index on the vector column and B-tree indexes on the metadata columns.
+
+        Args:
+            table_name (str): The table to index.
+            vector_col (str): The vector column to build the ANN index on.
+            index_type (str): 'hnsw' or 'ivfflat'. IVFFlat clusters the existing rows,
+                              so build it after the data has been inserted.
+            distance_ops (str): The pgvector operator class. 'vector_cosine_ops' matches
+                                the `<=>` operator used by search_metadata.
+            metadata_cols (tuple): Columns used as exact-match search filters.
+            hnsw_m (int): HNSW max connections per layer.
+            hnsw_ef_construction (int): HNSW candidate list size during build.
+            ivfflat_lists (int, optional): The number of IVFFlat lists. Defaults to None,
+                                           which derives it from the current row count
+                                           (rows / 1000 up to 1M rows, sqrt(rows) above).
+        """
+        if index_type == 'hnsw':
+            with_params = f"m = {int(hnsw_m)}, ef_construction = {int(hnsw_ef_construction)}"
+        elif index_type == 'ivfflat':
+            if ivfflat_lists is None:
+                ivfflat_lists = self._ivfflat_lists(table_name)
+            with_params = f"lists = {int(ivfflat_lists)}"
+        else:
+            raise ValueError(f"Unsupported vector index type: {index_type}")
+
+        index_sqls = [
+            f"CREATE INDEX IF NOT EXISTS {table_name}_{vector_col}_{index_type}_idx "
+            f"ON {table_name} USING {index_type} ({vector_col} {distance_ops}) WITH ({with_params});"
+        ]
+        # 학교급/학년 등으로 먼저 필터링한 뒤 벡터 정렬을 하기 위한 B-tree 인덱스
+        for col in metadata_cols:
+            index_sqls.append(f"CREATE INDEX IF NOT EXISTS {table_name}_{col}_idx ON {table_name} ({col});")
+        if len(metadata_cols) > 1:
+            joined_cols = ', '.join(metadata_cols)
+            index_sqls.append(
+                f"CREATE INDEX IF NOT EXISTS {table_name}_{'_'.join(metadata_cols)}_idx "
+                f"ON {table_name} ({joined_cols});"
+            )
+
+        for index_sql in index_sqls:
+            print(f"Executing: {index_sql}")
+            self.cursor.execute(index_sql)
+        # 플래너가 새 인덱스를 활용할 수 있도록 통계 갱신
+        self.cursor.execute(f"ANALYZE {table_name};")
+        self.conn.commit()
+        print(f"Indexes on '{table_name}' created successfully.")
+
     def insert_data(
         self,
         table_name,
@@ -111,6 +218,126 @@ class PostgresEmbeddingLoader:
         self.conn.commit()
         print("Data insertion complete.")
 
+    def _column_types(self, table_name):
+        """Returns {column: base SQL type name} for the table (e.g. 'vector(1024)' -> 'vector')."""
+        self.cursor.execute(
+            """SELECT attname, format_type(atttypid, atttypmod)
+                FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped""",
+            (table_name,)
+        )
+        return {name: sql_type.split("(")[0] for name, sql_type in self.cursor.fetchall()}
+
+    def _encode_copy_chunk(
+        self,
+        rows,
+        encoders,
+        ):
+        """Encodes rows into a complete PostgreSQL binary COPY payload."""
+        buf = io.BytesIO()
+        buf.write(PGCOPY_HEADER)
+        field_count = struct.pack("!h", len(encoders))
+        for row in rows:
+            buf.write(field_count)
+            for value, encode in zip(row, encoders):
+                if _is_null(value):
+                    buf.write(struct.pack("!i", -1))
+                else:
+                    data = encode(value)
+                    buf.write(struct.pack("!i", len(data)))
+                    buf.write(data)
+        buf.write(PGCOPY_TRAILER)
+        buf.seek(0)
+        return buf
+
+    def bulk_upsert(
+        self,
+        table_name,
+        df,
+        unique_col,
+        chunk_size=5000,
+        delete_missing=True,
+        ):
+        """
+        Syncs the table with a DataFrame using binary COPY into a staging table.
+
+        Rows are streamed in chunks of `chunk_size` with vectors binary-encoded,
+        then new rows are inserted, changed rows are updated by `unique_col`, and
+        (optionally) rows missing from the DataFrame are deleted, all in one transaction.
+
+        Args:
+            table_name (str): The target table.
+            df (pd.DataFrame): The full source data, including the embedding column.
+            unique_col (str): The unique key column used to match rows.
+            chunk_size (int): The number of rows per COPY payload.
+            delete_missing (bool): Delete table rows whose key is not in `df`.
+
+        Returns:
+            dict: The number of inserted, updated and deleted rows.
+        """
+        # 같은 키가 여러 번 있으면 ON CONFLICT가 실패하므로 마지막 행만 사용
+        df = df.drop_duplicates(subset=[unique_col], keep='last')
+        cols = ['order_val' if col.lower() == 'order' else col for col in df.columns]
+        col_types = self._column_types(table_name)
+        unsupported = [col for col in cols if col_types.get(col) not in COPY_ENCODERS]
+        if unsupported:
+            raise ValueError(f"Columns without a binary COPY encoder: {unsupported}")
+        encoders = [COPY_ENCODERS[col_types[col]] for col in cols]
+
+        stage_table = f"{table_name}_stage"
+        col_list = ', '.join(cols)
+        try:
+            self.cursor.execute(
+                f"CREATE TEMP TABLE {stage_table} ON COMMIT DROP AS "
+                f"SELECT {col_list} FROM {table_name} WITH NO DATA;"
+            )
+
+            print(f"Copying {len(df)} rows into '{stage_table}' in chunks of {chunk_size}...")
+            rows = df.itertuples(index=False, name=None)
+            for start in range(0, len(df), chunk_size):
+                chunk = [next(rows) for _ in range(min(chunk_size, len(df) - start))]
+                self.cursor.copy_expert(
+                    f"COPY {stage_table} ({col_list}) FROM STDIN WITH (FORMAT binary)",
+                    self._encode_copy_chunk(chunk, encoders),
+                )
+
+            # 내용이 바뀐 행만 갱신하고 새 행은 추가 (xmax = 0 이면 새로 추가된 행)
+            update_cols = [col for col in cols if col != unique_col]
+            set_sql = ', '.join(f"{col} = EXCLUDED.{col}" for col in update_cols)
+            changed_sql = (
+                f"({', '.join(f'{table_name}.{col}' for col in update_cols)}) IS DISTINCT FROM "
+                f"({', '.join(f'EXCLUDED.{col}' for col in update_cols)})"
+            )
+            self.cursor.execute(
+                f"""INSERT INTO {table_name} ({col_list})
+                    SELECT {col_list} FROM {stage_table}
+                    ON CONFLICT ({unique_col}) DO UPDATE SET {set_sql}
+                    WHERE {changed_sql}
+                    RETURNING (xmax = 0)"""
+            )
+            upserted = [inserted for (inserted,) in self.cursor.fetchall()]
+            result = {
+                "inserted": sum(upserted),
+                "updated": len(upserted) - sum(upserted),
+                "deleted": 0,
+            }
+
+            if delete_missing:
+                self.cursor.execute(
+                    f"""DELETE FROM {table_name} t
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM {stage_table} s WHERE s.{unique_col} = t.{unique_col}
+                        )"""
+                )
+                result["deleted"] = self.cursor.rowcount
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        print(f"Bulk upsert into '{table_name}' complete: {result}")
+        return result
+
     def close_connection(self):
         """Closes the database cursor and connection."""
         if self.cursor:
@@ -136,7 +363,16 @@ if __name__ == '__main__':
         output_json_path_tpl = pwd + "/all_basecode_embeddings_{model_name}.json"
         column_to_embed = 'content'  # The name of the column you want to embed
         
-        embedder = JsonEmbedder(model_name,output_json_path_tpl)
+        # Set EMBEDDING_NUM_WORKERS to spread local embedding across CPU cores
+        num_workers = int(os.environ.get("EMBEDDING_NUM_WORKERS", 1))
+        # For Gemini models, GEMINI_RPM paces requests and GEMINI_BASE_URL points at another endpoint
+        embedder = JsonEmbedder(
+            model_name,
+            output_json_path_tpl,
+            num_workers=num_workers,
+            requests_per_minute=float(os.environ["GEMINI_RPM"]) if "GEMINI_RPM" in os.environ else None,
+            base_url=os.environ.get("GEMINI_BASE_URL"),
+        )
         output_json_path = embedder.concated_outpath
 
         print("\n--- Starting Embedding Process ---")
@@ -146,20 +382,19 @@ if __name__ == '__main__':
         print("------------------------------------")
 
         # 3. Run the process
+        # Only new or edited rows are embedded; unchanged rows come from the embedding store.
         # Note: This example will not run if the input file does not exist.
-        if os.path.exists(output_json_path):
-            print("Already embedded file exists skip to load on pgvector")
-            
-        else:
-            try:
-                embedder.process_file(
-                    input_path=input_json_path,
-                    column_to_embed=column_to_embed
-                )
-            except FileNotFoundError:
-                print(f"Example skipped: Input file '{input_json_path}' not found.")
-                print("Please update the 'input_json_path' variable in the script to point to your file.")
-                raise
+        try:
+            embedder.process_file(
+                input_path=input_json_path,
+                column_to_embed=column_to_embed,
+                output_format=embedding_output_format,
+                dtype=embedding_dtype,
+            )
+        except FileNotFoundError:
+            print(f"Example skipped: Input file '{input_json_path}' not found.")
+            print("Please update the 'input_json_path' variable in the script to point to your file.")
+            raise
 
     except ValueError as e:
         print(f"Error: {e}")
@@ -169,8 +404,17 @@ if __name__ == '__main__':
 
     try:
         print("Start insert embedded file to pgvector")
-        # 1. Load data from a JSON file into a pandas DataFrame
-        df = pd.read_json(output_json_path)
+        # 1. Load the embedded data into a pandas DataFrame
+        load_mode = os.environ.get("LOAD_MODE", "copy")
+        if embedding_output_format == "npy":
+            output_json_path = artifact_paths(output_json_path)[0]
+            metadata, vectors = load_embedding_artifact(output_json_path)
+            # COPY 모드는 메모리 매핑된 벡터 행을 그대로 binary로 인코딩
+            df = metadata.assign(
+                embedding=list(vectors) if load_mode == "copy" else [vector.tolist() for vector in vectors]
+            )
+        else:
+            df = pd.read_json(output_json_path)
         print(f"Loaded {len(df)} records from '{output_json_path}'")
 
         # 2. Dynamically create a table from the DataFrame
@@ -186,13 +430,25 @@ if __name__ == '__main__':
             unique_col='basecode'
         )
 
-        # 3. Insert the data into the newly created table
-        loader.insert_data(table_name=table_name, df=df, unique_col='basecode')
+        # 3. Sync the data into the table
+        #    copy: binary COPY + upsert of changed rows + delete of removed rows (default)
+        #    insert: execute_values insert that skips existing rows
+        if load_mode == "copy":
+            loader.bulk_upsert(table_name=table_name, df=df, unique_col='basecode')
+        else:
+            loader.insert_data(table_name=table_name, df=df, unique_col='basecode')
+
+        # 4. Build the ANN and metadata indexes after the data is loaded
+        loader.create_indexes(
+            table_name=table_name,
+            vector_col='embedding',
+            index_type=os.environ.get("VECTOR_INDEX_TYPE", "hnsw"),
+        )
 
     except FileNotFoundError:
         print(f"Error: The file '{output_json_path}' was not found.")
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        # 4. Close the database connection
+        # 5. Close the database connection
         loader.close_connection()